@@ -0,0 +1,46 @@
+'''
+Time taken to import olap.xmla.xmla and to make the first and further
+connections, each measured in a fresh interpreter:
+
+    python benchmarks/connect.py [--runs 5]
+
+Connecting doesn't talk to the server, the location need not exist.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SCRIPT = '''
+import json, time
+t0 = time.perf_counter()
+import olap.xmla.xmla as xmla
+t1 = time.perf_counter()
+p = xmla.XMLAProvider()
+p.connect(location="http://localhost:8080/mondrian/xmla")
+t2 = time.perf_counter()
+p.connect(location="http://localhost:8080/mondrian/xmla")
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first connect": t2 - t1, "next connect": t3 - t2}))
+'''
+
+
+def run(runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    timings = []
+    for i in range(runs):
+        out = subprocess.run([sys.executable, "-c", SCRIPT], env=env, check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        timings.append(json.loads(out.decode("utf-8").splitlines()[-1]))
+    for key in ("import", "first connect", "next connect"):
+        values = [t[key] * 1000 for t in timings]
+        print("%-14s median %8.2f ms   min %8.2f ms" % (key, statistics.median(values), min(values)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    run(parser.parse_args().runs)
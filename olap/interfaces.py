@@ -99,7 +99,8 @@ class ICatalog(IOLAPSchemaElement):
 class IMDXResult(Interface):
     def getSlice(properties=None, **kw):
         """
-        getSlice(properties=None [,Axis<Number>=n|Axis<Number>=[i1,i2,..,ix]])
+        getSlice(properties=None [,Axis<Number>=n|Axis<Number>=[i1,i2,..,ix]|
+                                   Axis<Number>=slice(..)|Axis<Number>=[True,False,..]])
         
         Return the resulting cells from a MDX statement. 
         The result is presented as an array of arrays of arrays of... 
@@ -115,6 +116,8 @@ class IMDXResult(Interface):
         result.getSlice(Axis1=[1,2]) # return the data sliced at the 2nd and 3rd row
         result.getSlice(Axis0=3, Axis1=[1,2]) # return the data sliced at the 2nd and 
                                                 3rd row in addition to the 4th column
+        result.getSlice(Axis0=slice(0, 10, 2)) # every other of the first 10 columns
+        result.getSlice(Axis1=[True, False, True]) # select rows by a boolean mask
         
         If you do not want the whole cell returned but just a single property of it 
         (like the Value) name that property in the property parameter:
@@ -0,0 +1,140 @@
+'''
+Binary columnar encodings of query results, sent by the REST service
+instead of json if asked for.
+
+application/x-olap-columnar is a typed array layout readable without any
+library: the magic b"OLC1", the length of the header as little endian
+uint32, the header as json, then the columns. The header holds the
+metadata of the query, the selected tuples of the axes, the shape of the
+cell grid (tuple counts Axis0...AxisN, cells are in that order with Axis0
+running fastest) and a description of each column:
+
+    {"name": "Value", "type": "float64", "offset": 0, "length": 80,
+     "valid": {"offset": 80, "length": 10}}
+
+offset and length locate the data relative to the end of the header, which
+is padded so every column starts at a multiple of 8. float64 and int64
+columns come with one validity byte per cell, "dictionary" columns are
+uint32 indices into the strings in the header's "dictionary" of the
+column, offset by one, 0 marking a cell without the property. Values of
+"json" columns are in the header's "values". All numbers are little endian.
+
+application/vnd.apache.arrow.stream is an arrow IPC stream (needs pyarrow)
+with a column per axis giving the position of the cell's tuple among the
+selected ones, a column per cell property and the header as json in the
+schema metadata "olap".
+'''
+import json
+import struct
+import sys
+from array import array
+
+from olap.rest.store import columnKind
+from olap.xmla.formatreader import ARROW, arrowColumn, pyarrow
+from olap.xmla.utils import aslist, _missing
+
+COLUMNAR = "application/x-olap-columnar"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+MAGIC = b"OLC1"
+columntypes = {"d": "float64", "q": "int64", "s": "dictionary", "j": "json"}
+
+
+def selectedColumns(res, properties, selection):
+    """Return the shape of the cells of res selected (see getSlice) and
+    the values of each property of them as (name, values) pairs, _missing
+    for cells without the property. All properties if properties is None."""
+    indices = res.getAxisIndices(**selection)
+    shape = [len(idx) for idx in indices]
+    cells = [cell for row in res.iterSlice(**selection) for cell in row]
+    if properties is None:
+        names = []
+        for cell in cells:
+            for prop in cell:
+                if prop != "text" and not prop.startswith("_") and prop not in names:
+                    names.append(prop)
+    else:
+        names = aslist(properties)
+    columns = []
+    for name in names:
+        values = [cell.get(name) for cell in cells]
+        columns.append((name, [_missing if v is None else v for v in values]))
+    return shape, columns
+
+
+def pad(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+def littleEndian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def encodeColumnar(res, properties, selection, header):
+    """Return the selected cells of res in the typed array layout, header
+    (json encodable) is sent along."""
+    shape, columns = selectedColumns(res, properties, selection)
+    buffers = []
+    offset = 0
+    descs = []
+    for (name, values) in columns:
+        kind = columnKind(values)
+        desc = {"name": name, "type": columntypes[kind]}
+        if kind == "s":
+            strings = {}
+            data = littleEndian(array("I", [0 if v is _missing else strings.setdefault(v, len(strings) + 1)
+                                            for v in values]))
+            desc["dictionary"] = list(strings)
+        elif kind == "j":
+            desc["values"] = [None if v is _missing else v for v in values]
+            data = b""
+        else:
+            data = littleEndian(array(kind, [0 if v is _missing else v for v in values]))
+        desc["offset"], desc["length"] = offset, len(data)
+        offset += len(pad(data))
+        buffers.append(pad(data))
+        if kind in "dq":
+            valid = bytes(v is not _missing for v in values)
+            desc["valid"] = {"offset": offset, "length": len(valid)}
+            offset += len(pad(valid))
+            buffers.append(pad(valid))
+        descs.append(desc)
+
+    head = json.dumps(dict(header, shape=shape, columns=descs), separators=(",", ":")).encode("utf-8")
+    # the columns start at a multiple of 8 counted from the start of the body
+    head = head + b" " * (-(len(MAGIC) + 4 + len(head)) % 8)
+    return b"".join([MAGIC, struct.pack("<I", len(head)), head] + buffers)
+
+
+# the xsd type arrowColumn is told for the kinds of columns
+arrowkinds = {"d": "double", "q": "long"}
+
+
+def encodeArrow(res, properties, selection, header):
+    """Return the selected cells of res as arrow IPC stream, header (json
+    encodable) is sent in the schema metadata."""
+    if not ARROW:
+        raise ImportError("The arrow format needs pyarrow installed.")
+    shape, columns = selectedColumns(res, properties, selection)
+    count = 1
+    for n in shape:
+        count = count * n
+    names = []
+    arrays = []
+    stride = 1
+    for (axis, n) in enumerate(shape):
+        names.append("Axis%d" % axis)
+        arrays.append(pyarrow.array([(i // stride) % n for i in range(count)], type=pyarrow.int32()))
+        stride = stride * n
+    for (name, values) in columns:
+        names.append(name)
+        arrays.append(arrowColumn(values, arrowkinds.get(columnKind(values))))
+
+    batch = pyarrow.RecordBatch.from_arrays(arrays, names=names)
+    schema = batch.schema.with_metadata({"olap": json.dumps(dict(header, shape=shape))})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch.replace_schema_metadata(schema.metadata))
+    return sink.getvalue().to_pybytes()
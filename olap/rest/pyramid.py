@@ -1,6 +1,11 @@
+import datetime
+import email.utils
 import functools
+import hashlib
+import itertools
 import json
 import logging
+import time
 import uuid
 from types import MethodType
 
@@ -12,6 +17,9 @@ from webob import Response, exc
 import olap.interfaces as oi
 import olap.xmla.interfaces as oxi
 import olap.xmla.utils as utils
+from olap.rest.columnar import ARROW_STREAM, COLUMNAR, encodeArrow, encodeColumnar
+from olap.rest.store import MemoryQueryStore
+from olap.xmla.formatreader import ARROW
 from olap.xmla.xmla import TREE_OP
 
 try:
@@ -23,6 +31,13 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# newline delimited json, one json document per line
+NDJSON = "application/x-ndjson"
+
+# encoder and content type of the binary formats of query results
+binaryformats = {"columnar": (encodeColumnar, COLUMNAR),
+                 "arrow": (encodeArrow, ARROW_STREAM)}
+
 
 class _404(exc.HTTPError):
     def __init__(self, msg='Not Found'):
@@ -32,6 +47,22 @@ class _404(exc.HTTPError):
         self.content_type = 'application/json'
 
 
+class _400(exc.HTTPError):
+    def __init__(self, msg='Bad Request'):
+        body = {'status': 400, 'message': msg}
+        Response.__init__(self, json.dumps(body))
+        self.status = 400
+        self.content_type = 'application/json'
+
+
+class _406(exc.HTTPError):
+    def __init__(self, msg='Not Acceptable'):
+        body = {'status': 406, 'message': msg}
+        Response.__init__(self, json.dumps(body))
+        self.status = 406
+        self.content_type = 'application/json'
+
+
 class _502(exc.HTTPError):
     def __init__(self, msg='Bad Gateway'):
         body = {'status': 502, 'message': msg}
@@ -66,14 +97,23 @@ Issue MDX queries and retrieve the result.
 """,
     "QUERY_single_get": """
 Return result and axes information from a query identified by its ID.
+Parts of the result are selected by the parameters properties (comma
+separated), Axis<Number> (an index, comma separated indices or a range
+start:stop) and page_size/page (paging the rows or page_axis, page counting
+from 0). With stream=json or stream=ndjson (or an Accept header preferring
+application/x-ndjson) the cells are streamed row by row. With format=columnar
+or format=arrow (or an Accept header preferring application/x-olap-columnar
+or application/vnd.apache.arrow.stream) the cells are sent column wise in a
+binary format, see olap.rest.columnar.
 """,
     "QUERY_coll_get": """
-Return all cached queries.
+Return the ID, MDX and axis sizes of all cached queries.
 """,
     "QUERY_single_post": """
 Issue a new MDX query. The answer returned contains the resultset and axes 
 information as well as an ID by which the result is cached on the server and
-can be retrieved again.
+can be retrieved again. The parameters selecting parts of the result may be
+passed in the body as well.
 """,
     "CUBE": """
 Retrieve information about a cube.
@@ -344,7 +384,8 @@ def restify(exposefully=False, **kw):
                                                 path=p,
                                                 description=desc,
                                                 renderer="jsonp",
-                                                accept="application/json"
+                                                accept=["application/json", NDJSON,
+                                                        COLUMNAR, ARROW_STREAM]
                                                 )
                 for verb in ("get", "post", "put", "delete", "patch", "options"):
                     methodname = prefix + schemaElementName.lower() + "_" + verb
@@ -388,6 +429,25 @@ def restify(exposefully=False, **kw):
 
 
 class OLAPREST(object):
+    # keeps the results of the queries posted, the session only holds
+    # the IDs of its (at most maxqueries latest) queries. Use a
+    # DiskQueryStore to share the results between worker processes
+    querystore = MemoryQueryStore()
+    maxqueries = 100
+    # sent with the schema elements, e.g. "public, max-age=3600" to let
+    # shared caches keep them as well. None to send no Cache-Control
+    cachecontrol = "private, max-age=60"
+    # derive the ETag of schema elements from the LAST_SCHEMA_UPDATE of the
+    # cubes they belong to, so a request can be answered with 304 without
+    # fetching them. If False (or the cubes are not known) the ETag is
+    # computed from the elements
+    schemaversions = True
+    # seconds the schema version of a catalog or cube is reused without
+    # asking the server again
+    schemaversion_ttl = 10
+    # (datasource, catalog, cube) -> (expires, version)
+    _schemaversions = {}
+
     def __init__(self, request):
         self.request = request
         self.kw = self.request.matchdict.copy()
@@ -395,14 +455,13 @@ class OLAPREST(object):
             self.kw.update(self.fixedvalues)
 
         try:
-            s = self.request.session
-            if "queries" not in s:
-                s["queries"] = {}
-            self.q = s["queries"]
+            self.session = self.request.session
+            self.q = list(self.session.get("queries", []))
         except:
             # no session configured
             logger.warning("no sessioning configured!")
-            self.q = {}  # one-off
+            self.session = None
+            self.q = []  # one-off
 
     def _serialize(self, name, olap):
         ds = {}
@@ -459,7 +518,7 @@ class OLAPREST(object):
     def get(self, schemaElementName=None, callsequence=None, aslist=False,
             altSchemaElementName=None):
         ds = self.datasource_get()
-        self.kw.pop("ds_name")
+        dsname = self.kw.pop("ds_name")
 
         # if we ask for, say catalogs, but have also a fixed cube defined
         # we will have the variable for the CUBE in the kw.
@@ -468,22 +527,132 @@ class OLAPREST(object):
             if k not in self.neededvars[schemaElementName]:
                 del self.kw[k]
 
+        stream = self._streamformat(self.request.GET) if aslist else None
+        element = altSchemaElementName or schemaElementName
+        headers = {}
+        cubes = None
+        if self.schemaversions and oxi.IXMLASource.providedBy(ds) and "CATALOG_NAME" in self.kw:
+            # the cubes asked for are the rowset the version is taken from
+            ascubes = element == "CUBE" and stream is None and \
+                set(self.kw) <= set(["CATALOG_NAME", "CUBE_NAME"])
+            version, cubes = self._schemaversion(ds, dsname, fresh=ascubes)
+            if version is not None:
+                headers = self._validators([version, stream, sorted(self.kw.items()),
+                                            sorted(self.request.GET.items())], version[0])
+                if self._notmodified(headers):
+                    return self._cached(headers)
+            if not ascubes:
+                cubes = None
         try:
-            if oxi.IXMLASource.providedBy(ds):
-                return utils.dictify(ds.getSchemaElements(
-                    altSchemaElementName or schemaElementName,
+            if cubes:
+                result = utils.dictify(cubes if aslist else cubes[0])
+            elif oxi.IXMLASource.providedBy(ds) and stream is not None:
+                result = self._streamed(stream, ds.iterSchemaElements(
+                    element,
+                    None,
+                    more_restrictions=self.kw,
+                    generate_instance=False))
+            elif oxi.IXMLASource.providedBy(ds):
+                result = utils.dictify(ds.getSchemaElements(
+                    element,
                     None,
                     aslist=aslist,
                     more_restrictions=self.kw,
                     generate_instance=False))
+            elif stream is not None:
+                result = self._streamed(stream, self.get_iolap(ds, callsequence))
             else:
-                return self.get_iolap(ds, callsequence)
+                result = self.get_iolap(ds, callsequence)
         except oxi.SchemaElementNotFound as e:
             raise _404({"restrictions:": e.restrictions, "properties": e.properties})
         except oi.OlapException as e:
             msg = {"errormessage": e.message, "errorfault": str(e.detail)}
             raise _502(msg)
 
+        if isinstance(result, Response):
+            # streamed, validated by the schema version only
+            result.headers.update(headers)
+            return result
+        if not headers:
+            headers = self._validators(result)
+            if self._notmodified(headers):
+                return self._cached(headers)
+        self.request.response.headers.update(headers)
+        return result
+
+    def _schemaversion(self, ds, dsname, fresh=False):
+        """Return the latest LAST_SCHEMA_UPDATE and LAST_DATA_UPDATE of the
+        cubes the requested elements belong to (those of the cube or the
+        catalog requested) along with all of them, None if they are not
+        known. The version is reused for schemaversion_ttl seconds unless
+        fresh, in which case the cube rows fetched are returned as well."""
+        key = (dsname, self.kw["CATALOG_NAME"], self.kw.get("CUBE_NAME"))
+        entry = self._schemaversions.get(key)
+        if not fresh and self.schemaversion_ttl and entry is not None and entry[0] > time.time():
+            return entry[1], None
+        restrictions = dict((k, self.kw[k]) for k in ("CATALOG_NAME", "CUBE_NAME") if k in self.kw)
+        try:
+            cubes = utils.aslist(ds.getSchemaElements("CUBE", None, aslist=True,
+                                                      more_restrictions=restrictions,
+                                                      generate_instance=False))
+        except (oxi.SchemaElementNotFound, oi.OlapException):
+            return None, None
+        updates = [[cube.get("CUBE_NAME"), cube.get("LAST_SCHEMA_UPDATE"), cube.get("LAST_DATA_UPDATE")]
+                   for cube in cubes]
+        if not updates or any(update[1] is None for update in updates):
+            return None, cubes
+        version = max(u for update in updates for u in update[1:] if u), updates
+        if self.schemaversion_ttl:
+            if len(self._schemaversions) > 10000:
+                self._schemaversions.clear()
+            self._schemaversions[key] = (time.time() + self.schemaversion_ttl, version)
+        return version, cubes
+
+    def _validators(self, content, modified=None):
+        """Return the caching headers for a response, the (weak) ETag being
+        a hash of content. modified is the xsd dateTime the content was
+        last changed at, if known, sent as Last-Modified if it has a time
+        zone."""
+        digest = hashlib.sha1(json.dumps(utils.dictify(content), sort_keys=True,
+                                         default=str).encode("utf-8")).hexdigest()
+        headers = {"ETag": 'W/"%s"' % digest, "Vary": "Accept"}
+        if modified is not None:
+            try:
+                modified = datetime.datetime.fromisoformat(modified.replace("Z", "+00:00"))
+            except ValueError:
+                modified = None
+            # without a time zone the server's local time is meant, which
+            # is not known here
+            if modified is not None and modified.tzinfo is not None:
+                headers["Last-Modified"] = email.utils.format_datetime(
+                    modified.astimezone(datetime.timezone.utc), usegmt=True)
+        if self.cachecontrol:
+            headers["Cache-Control"] = self.cachecontrol
+        return headers
+
+    def _notmodified(self, headers):
+        """Whether the client has the response with the headers already,
+        according to If-None-Match or (without it) If-Modified-Since."""
+        request = self.request.headers
+        if "If-None-Match" in request:
+            etags = [etag.strip() for etag in request["If-None-Match"].split(",")]
+            etag = headers["ETag"][2:]
+            return "*" in etags or any(e[2:] == etag if e.startswith("W/") else e == etag for e in etags)
+        if "If-Modified-Since" in request and "Last-Modified" in headers:
+            try:
+                since = email.utils.parsedate_to_datetime(request["If-Modified-Since"])
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            return email.utils.parsedate_to_datetime(headers["Last-Modified"]) <= since
+        return False
+
+    def _cached(self, headers):
+        response = Response(status=304)
+        response.headers.update(headers)
+        return response
+
     def collection_hm_children_get(self,
                                    schemaElementName=None,
                                    callsequence=None,
@@ -528,38 +697,208 @@ class OLAPREST(object):
         return result
 
     ############################ query related methods #########################
+    def _axistuples(self, res):
+        axistuple = []
+        try:
+            axis = 0
+            while True:
+                axistuple.append(res.getAxisTuple(axis))
+                axis += 1
+        except:
+            pass
+        return axistuple
+
+    def _select(self, res, prop, params):
+        """Return the properties, the tuple indices per axis and the paging
+        information selected by params (see the documentation of
+        QUERY_single_get). The indices are None if no axis is selected."""
+        prop = params.get("properties", prop)
+        if isinstance(prop, utils.stringtypes) and "," in prop:
+            prop = [p.strip() for p in prop.split(",")]
+        names = [ax._name for ax in res.getAxes()]
+        if not [p for p in ["page_size"] + names if p in params]:
+            return prop, None, {}
+
+        selection = dict((name, self._axisselection(name, params[name]))
+                         for name in names if name in params)
+        info = {"counts": dict((ax._name, res.getTupleCount(ax)) for ax in res.getAxes())}
+        try:
+            indices = res.getAxisIndices(**selection)
+            if "page_size" in params and names:
+                axis = params.get("page_axis", names[1] if len(names) > 1 else names[0])
+                pos = names.index(axis)
+                size = int(params["page_size"])
+                page = int(params.get("page", 0))
+                if size < 1 or page < 0:
+                    raise ValueError("page_size has to be positive, page not negative")
+                info["page"] = page
+                info["pages"] = max(1, (len(indices[pos]) + size - 1) // size)
+                info["page_axis"] = axis
+                indices[pos] = indices[pos][page * size:(page + 1) * size]
+        except (TypeError, ValueError) as e:
+            raise _400(str(e))
+        return prop, indices, info
+
+    def _query(self, uid, res, mdx, prop, params=None):
+        """Return the result res of query uid, or the part of it selected
+        by params, streamed if asked for (see _streamformat)."""
+        params = params or {}
+        stream = self._streamformat(params)
+        binary = self._binaryformat(params)
+        prop, indices, result = self._select(res, prop, params)
+        if indices is None and stream is None and binary is None:
+            return utils.dictify({
+                "axes": self._axistuples(res),
+                "cells": res.getSlice(properties=prop),
+                "id": uid,
+                "mdx": mdx
+            })
+
+        names = [ax._name for ax in res.getAxes()]
+        if indices is None:
+            indices = res.getAxisIndices()
+        selection = dict(zip(names, indices))
+        axes = self._axistuples(res)
+        for (pos, idx) in enumerate(indices):
+            axes[pos] = [axes[pos][i] for i in idx]
+        result.update({"axes": axes, "id": uid, "mdx": mdx})
+        if binary is not None:
+            encode, content_type = binaryformats[binary]
+            return Response(body=encode(res, prop, selection, utils.dictify(result)),
+                            content_type=content_type)
+        if stream is not None:
+            # the cells row by row, see TupleFormatReader.iterSlice
+            return self._streamed(stream, res.iterSlice(properties=prop, **selection),
+                                  head=utils.dictify(result), key="cells")
+        result["cells"] = res.getSlice(properties=prop, **selection)
+        return utils.dictify(result)
+
+    def _streamformat(self, params):
+        """Return "ndjson" or "json" if the response is to be streamed, as
+        asked for by the parameter stream or by accepting NDJSON rather
+        than JSON, None otherwise."""
+        fmt = params.get("stream")
+        if fmt is None:
+            accept = getattr(self.request, "accept", None)
+            offers = accept.acceptable_offers(["application/json", NDJSON]) if accept is not None else []
+            if offers and offers[0][0] == NDJSON:
+                fmt = "ndjson"
+        if fmt not in (None, "json", "ndjson"):
+            raise _400("Invalid stream format %r, use json or ndjson" % fmt)
+        return fmt
+
+    def _binaryformat(self, params):
+        """Return "columnar" or "arrow" if the cells are to be sent in one
+        of the binary formats, as asked for by the parameter format or by
+        accepting the format rather than JSON, None otherwise."""
+        fmt = params.get("format")
+        if fmt is None:
+            accept = getattr(self.request, "accept", None)
+            offers = accept.acceptable_offers(["application/json", NDJSON, COLUMNAR, ARROW_STREAM]) \
+                if accept is not None else []
+            if offers and offers[0][0] in (COLUMNAR, ARROW_STREAM):
+                fmt = "columnar" if offers[0][0] == COLUMNAR else "arrow"
+        if fmt not in (None, "json", "columnar", "arrow"):
+            raise _400("Invalid format %r, use json, columnar or arrow" % fmt)
+        if fmt == "arrow" and not ARROW:
+            raise _406("The arrow format needs pyarrow installed on the server")
+        return None if fmt == "json" else fmt
+
+    def _streamed(self, fmt, items, head=None, key=None):
+        """
+        Return a response encoding the items while they are generated. For
+        ndjson each item is sent on a line of its own, after head if given.
+        For json the items are sent as array, or as entry key of head.
+        The first item is generated right away, so errors getting at it
+        still end up in an error response.
+        """
+        items = iter(items)
+        first = next(items, utils._missing)
+        if first is not utils._missing:
+            items = itertools.chain([first], items)
+
+        def encode(item):
+            return json.dumps(utils.dictify(item)).encode("utf-8")
+
+        def ndjson():
+            if head is not None:
+                yield encode(head) + b"\n"
+            for item in items:
+                yield encode(item) + b"\n"
+
+        def array():
+            if head is None:
+                opening, closing = b"[", b"]"
+            else:
+                opening = json.dumps(dict(head, **{key: []})).encode("utf-8")
+                closing = opening[opening.rindex(b"]"):]
+                opening = opening[:opening.rindex(b"]")]
+            sep = b""
+            yield opening
+            for item in items:
+                yield sep + encode(item)
+                sep = b","
+            yield closing
+
+        if fmt == "ndjson":
+            return Response(app_iter=ndjson(), content_type=NDJSON)
+        return Response(app_iter=array(), content_type="application/json")
+
+    def _axisselection(self, name, spec):
+        """Return the selection of tuples on axis name for getSlice, spec is
+        an index, a list of them or a string of comma separated indices or
+        of a range start:stop."""
+        # a json body may send any type
+        if isinstance(spec, bool) or not isinstance(spec, (int, list, utils.stringtypes)) or \
+                (isinstance(spec, list) and
+                 [i for i in spec if isinstance(i, bool) or not isinstance(i, int)]):
+            raise _400("Invalid selection of %s: %r" % (name, spec))
+        try:
+            if isinstance(spec, (int, list)):
+                return spec
+            if ":" in spec:
+                (start, stop) = spec.split(":", 1)
+                return slice(int(start) if start.strip() else None,
+                             int(stop) if stop.strip() else None)
+            return [int(i) for i in spec.split(",") if i.strip()]
+        except (TypeError, ValueError):
+            raise _400("Invalid selection of %s: %r" % (name, spec))
+
+    def _stored(self, uid):
+        """Return the stored result of the query uid of this session."""
+        res = self.querystore.get(uid) if uid in self.q else None
+        if res is None:
+            raise _404("No query with ID '%s' found." % uid)
+        return res
+
     def collection_query_get(self, schemaElementName=None, callsequence=None):
-        return self.q
+        queries = {}
+        for uid in self.q:
+            info = self.querystore.getInfo(uid)
+            if info is not None:
+                queries[uid] = info
+        return queries
 
     def query_get(self, schemaElementName=None, callsequence=None):
-        try:
-            return self.q[self.kw["QUERY_ID"]]
-        except:
-            raise _404("No query with ID '%s' found." % self.kw.get("QUERY_ID", "None"))
+        uid = self.kw.get("QUERY_ID", "None")
+        res = self._stored(uid)
+        return self._query(uid, res, res.meta["mdx"], res.meta["properties"],
+                           self.request.GET)
 
     def collection_query_post(self, schemaElementName=None, callsequence=None):
         r = self.request.json_body.copy()
         ds = self.datasource_get()
         cat = ds.getCatalog(self.request.matchdict["CATALOG_NAME"])
         res = cat.query(r["mdx"])
-        axistuple = []
-        try:
-            axis = 0
-            while True:
-                axistuple.append(res.getAxisTuple(axis))
-                axis += 1
-        except:
-            pass
         prop = r.get("properties", None)
-        slices = res.getSlice(properties=prop)
         uid = str(uuid.uuid4())
-        self.q[uid] = utils.dictify({
-            "axes": axistuple,
-            "cells": slices,
-            "id": uid,
-            "mdx": r["mdx"]
-        })
-        return self.q[uid]
+        self.querystore.put(uid, res, mdx=r["mdx"], properties=prop)
+        # the store of this process may not know all the queries of the
+        # session, so they are not pruned by what it holds
+        self.q = (self.q + [uid])[-self.maxqueries:]
+        if self.session is not None:
+            self.session["queries"] = self.q
+        return self._query(uid, res, r["mdx"], prop, r)
 
     @classmethod
     def register_service(cls, config):
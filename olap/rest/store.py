@@ -0,0 +1,473 @@
+'''
+Storage for the results of the queries posted to the REST service.
+
+Results are kept apart from the session, which only holds the IDs of its
+queries. A result is stored in a compact binary form: the axes and other
+metadata as compressed json, the cells column wise per cell property,
+numbers as int64/float64 arrays and strings dictionary encoded. Stored
+results are decoded lazily, cells are only read when asked for.
+
+A MemoryQueryStore is private to its process. If the requests of a session
+may be served by several worker processes, have them share the results
+through a DiskQueryStore on a common directory:
+
+    from olap.rest.store import MemoryQueryStore, DiskQueryStore
+
+    class MyREST(OLAPREST):
+        querystore = DiskQueryStore("/var/cache/olap-queries", maxbytes=2 ** 30)
+'''
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+from olap.xmla.formatreader import TupleFormatReader
+from olap.xmla.utils import Data, aslist, datafy, dictify, _missing
+
+MAGIC = b"OLQ1"
+# magic, length of the header, length of the axis tuples
+_head = struct.Struct("<4sII")
+
+
+def columnKind(values):
+    """Return the typecode of the array holding the values present in a
+    column, "s" for dictionary encoded strings or "j" for json."""
+    kinds = set(v.__class__ for v in values if v is not _missing)
+    if kinds <= set([int]):
+        if all(-2 ** 63 <= v < 2 ** 63 for v in values if v is not _missing):
+            return "q"
+        return "j"
+    if kinds <= set([int, float]):
+        return "d"
+    if kinds <= set([str]):
+        return "s"
+    return "j"
+
+
+def encodeColumn(values, buffers, offset):
+    """Append the buffers of a column to buffers, return its description
+    and the offset following its buffers."""
+    kind = columnKind(values)
+    desc = {"kind": kind}
+    if kind == "s":
+        # code 0 marks a cell without the property
+        strings = {}
+        codes = array("I", [0 if v is _missing else strings.setdefault(v, len(strings) + 1)
+                            for v in values])
+        desc["strings"] = list(strings)
+        data = codes.tobytes()
+    elif kind == "j":
+        desc["values"] = [None if v is _missing else v for v in values]
+        data = bytes(v is not _missing for v in values)
+    else:
+        data = array(kind, [0 if v is _missing else v for v in values]).tobytes()
+        desc["mask"] = (offset + len(data), len(values))
+        data = data + bytes(v is not _missing for v in values)
+    desc["data"] = (offset, len(data))
+    buffers.append(data)
+    return desc, offset + len(data)
+
+
+def encodeResult(res, **meta):
+    """
+    Return the multidimensional result res encoded as bytes, meta (e.g.
+    id, mdx) is kept along with it. All cell properties but the ordinal
+    are stored.
+    """
+    axes = []
+    tuples = []
+    for ax in aslist(getattr(res.root.Axes, "Axis", [])):
+        axes.append({"name": ax._name,
+                     "count": len(aslist(getattr(ax.Tuples, "Tuple", [])))})
+        tuples.append(dictify(res.getAxisTuple(ax._name) or []))
+    count = res.getCellCount()
+
+    columns = OrderedDict()
+    for ordinal in range(count):
+        cell = res.getCellByOrdinal(ordinal)
+        for (prop, value) in cell.items():
+            if prop == "text" or prop.startswith("_"):
+                continue
+            column = columns.get(prop)
+            if column is None:
+                column = columns[prop] = [_missing] * count
+            column[ordinal] = value
+
+    buffers = []
+    offset = 0
+    descs = []
+    for (prop, values) in columns.items():
+        desc, offset = encodeColumn(values, buffers, offset)
+        desc["name"] = prop
+        descs.append(desc)
+
+    header = compressJSON(dict(meta, axes=axes, cells=count, columns=descs, byteorder=sys.byteorder))
+    tuples = compressJSON(tuples)
+    return b"".join([_head.pack(MAGIC, len(header), len(tuples)), header, tuples] + buffers)
+
+
+def compressJSON(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def decompressJSON(view):
+    return json.loads(zlib.decompress(view).decode("utf-8"))
+
+
+def readHeader(buffer):
+    """Return the header of a stored result, the view of its axis tuples
+    and the view of its cell data."""
+    view = memoryview(buffer)
+    (magic, headerlength, tupleslength) = _head.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("not a stored query result")
+    start = _head.size + headerlength
+    header = decompressJSON(view[_head.size:start])
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError("stored query result has a different byte order")
+    return header, view[start:start + tupleslength], view[start + tupleslength:]
+
+
+def headerInfo(header):
+    """Return the metadata of a stored result along with the tuple counts
+    of its axes."""
+    info = dict((k, v) for (k, v) in header.items()
+                if k not in ("axes", "cells", "columns", "byteorder"))
+    info["counts"] = dict((ax["name"], ax["count"]) for ax in header["axes"])
+    return info
+
+
+class StoredColumn(object):
+    """The values of a cell property in a stored result."""
+
+    def __init__(self, desc, view):
+        self.name = desc["name"]
+        self.kind = desc["kind"]
+        (start, length) = desc["data"]
+        if self.kind == "s":
+            self.strings = [None] + desc["strings"]
+            self.codes = view[start:start + length].cast("I")
+        elif self.kind == "j":
+            self.values = desc["values"]
+            self.mask = view[start:start + length]
+        else:
+            (maskstart, masklength) = desc["mask"]
+            self.values = view[start:maskstart].cast(self.kind)
+            self.mask = view[maskstart:maskstart + masklength]
+
+    def get(self, ordinal):
+        """Return the value of the cell at ordinal, _missing if it has none."""
+        if self.kind == "s":
+            code = self.codes[ordinal]
+            return self.strings[code] if code else _missing
+        if not self.mask[ordinal]:
+            return _missing
+        return self.values[ordinal]
+
+
+class StoredCells(object):
+    """Cellmap of a stored result, the cells are built when asked for."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def get(self, ordinal, default=None):
+        cell = Data(_CellOrdinal=str(ordinal))
+        for column in self.columns:
+            value = column.get(ordinal)
+            if value is not _missing:
+                cell[column.name] = value
+        return cell if len(cell) > 1 else default
+
+
+class StoredResult(TupleFormatReader):
+    """
+    A result decoded from encodeResult's bytes (or a buffer like an mmap
+    holding them), usable like the result it was made from. The metadata
+    stored with it is in meta.
+    """
+
+    def __init__(self, buffer):
+        (header, tuples, data) = readHeader(buffer)
+        self.meta = headerInfo(header)
+        self.counts = self.meta.pop("counts")
+        self.columns = [StoredColumn(desc, data) for desc in header["columns"]]
+        axes = [Data(_name=ax["name"], Tuples=Data(Tuple=[Data(Member=t) for t in datafy(axtuples)]))
+                for (ax, axtuples) in zip(header["axes"], decompressJSON(tuples))]
+        super(StoredResult, self).__init__(Data(Axes=Data(Axis=axes)))
+
+    def mapOrdinalsToCells(self):
+        return StoredCells(self.columns)
+
+    def getTupleCount(self, ax):
+        return self.counts[ax._name]
+
+
+class QueryStore(object):
+    """
+    Base for the query result stores. Results expire ttl seconds after
+    they have been stored (None to keep them until evicted), the least
+    recently used ones are evicted as soon as all results together take
+    more than maxbytes.
+    """
+
+    def __init__(self, maxbytes=256 * 1024 * 1024, ttl=3600):
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # id -> (expires, size), ordered by last use
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, uid, res, **meta):
+        """Store the result res under uid, meta is stored along with it."""
+        blob = encodeResult(res, id=uid, **meta)
+        if len(blob) > self.maxbytes:
+            return
+        self.write(uid, blob)
+        with self.lock:
+            if uid in self.entries:
+                self.bytes -= self.entries.pop(uid)[1]
+            expires = None if self.ttl is None else time.time() + self.ttl
+            self.entries[uid] = (expires, len(blob))
+            self.bytes += len(blob)
+            evicted = []
+            while self.bytes > self.maxbytes:
+                evicted.append(self.evict(next(iter(self.entries))))
+                self.evictions += 1
+        for key in evicted:
+            self.remove(key)
+
+    def get(self, uid):
+        """Return the StoredResult for uid or None."""
+        buffer = self.lookup(uid)
+        return None if buffer is None else StoredResult(buffer)
+
+    def getInfo(self, uid):
+        """Return the metadata stored with the result for uid and the tuple
+        counts of its axes (as "counts"), without decoding the result.
+        None if there is no result for uid."""
+        buffer = self.lookup(uid)
+        return None if buffer is None else headerInfo(readHeader(buffer)[0])
+
+    def lookup(self, uid):
+        expired = False
+        with self.lock:
+            entry = self.entries.get(uid)
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                expired = self.evict(uid)
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(uid)
+        if expired:
+            self.remove(uid)
+        if entry is None:
+            return None
+        return self.read(uid)
+
+    def delete(self, uid):
+        with self.lock:
+            if uid in self.entries:
+                self.evict(uid)
+        self.remove(uid)
+
+    def evict(self, uid):
+        """Forget uid, the lock has to be held. Its data is dropped by remove
+        after the lock has been released."""
+        self.bytes -= self.entries.pop(uid)[1]
+        return uid
+
+    def __contains__(self, uid):
+        with self.lock:
+            entry = self.entries.get(uid)
+            return entry is not None and (entry[0] is None or entry[0] >= time.time())
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def write(self, uid, blob):
+        raise NotImplementedError
+
+    def read(self, uid):
+        """Return the bytes stored for uid (or a buffer holding them) or None."""
+        raise NotImplementedError
+
+    def remove(self, uid):
+        raise NotImplementedError
+
+    def getStats(self):
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "size": len(self.entries),
+                    "bytes": self.bytes,
+                    "maxbytes": self.maxbytes}
+
+
+class MemoryQueryStore(QueryStore):
+    """Keeps the encoded results in process memory."""
+
+    def __init__(self, maxbytes=256 * 1024 * 1024, ttl=3600):
+        super(MemoryQueryStore, self).__init__(maxbytes, ttl)
+        self.blobs = {}
+
+    def write(self, uid, blob):
+        self.blobs[uid] = blob
+
+    def read(self, uid):
+        return self.blobs.get(uid)
+
+    def remove(self, uid):
+        self.blobs.pop(uid, None)
+
+
+class DiskQueryStore(QueryStore):
+    """
+    Keeps the encoded results in files in directory, which are memory
+    mapped when read, so only the parts of a result used are paged in.
+    The files are the index: results are looked up in the directory, so
+    all processes using the same directory share their results. A result
+    expires ttl seconds after its file was written, the files used least
+    recently (as recorded in their access time) are removed as soon as
+    they take more than maxbytes together. Each process adds the bytes it
+    writes to the size of the directory it last saw and only scans the
+    directory again once that passes maxbytes.
+    """
+
+    suffix = ".olq"
+
+    def __init__(self, directory, maxbytes=1024 * 1024 * 1024, ttl=24 * 3600):
+        super(DiskQueryStore, self).__init__(maxbytes, ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # size of the results as of the last scan plus the bytes written since
+        self.bytes = sum(size for (used, uid, size) in self.scan())
+
+    def path(self, uid):
+        if os.sep in uid or (os.altsep and os.altsep in uid) or uid.startswith("."):
+            raise ValueError("invalid query id %r" % uid)
+        return os.path.join(self.directory, uid + self.suffix)
+
+    def expired(self, stat):
+        return self.ttl is not None and stat.st_mtime + self.ttl < time.time()
+
+    def stat(self, uid):
+        """Return the os.stat of the file of uid if it holds a result not
+        expired, None otherwise."""
+        try:
+            stat = os.stat(self.path(uid))
+        except (OSError, ValueError):
+            return None
+        if self.expired(stat):
+            self.remove(uid)
+            return None
+        return stat
+
+    def scan(self):
+        """Return (last used, uid, size) for the results in the directory,
+        removing the expired ones."""
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            uid = entry.name[:-len(self.suffix)]
+            if self.expired(stat):
+                self.remove(uid)
+            else:
+                found.append((stat.st_atime, uid, stat.st_size))
+        return found
+
+    def put(self, uid, res, **meta):
+        blob = encodeResult(res, id=uid, **meta)
+        if len(blob) > self.maxbytes:
+            return
+        self.write(uid, blob)
+        with self.lock:
+            self.bytes += len(blob)
+            if self.bytes <= self.maxbytes:
+                return
+        found = sorted(self.scan())
+        total = sum(size for (used, key, size) in found)
+        for (used, key, size) in found:
+            if total <= self.maxbytes:
+                break
+            if key != uid:
+                self.remove(key)
+                total -= size
+                with self.lock:
+                    self.evictions += 1
+        with self.lock:
+            self.bytes = total
+
+    def lookup(self, uid):
+        stat = self.stat(uid)
+        buffer = None if stat is None else self.read(uid)
+        with self.lock:
+            if buffer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if buffer is not None:
+            try:
+                # the access time tells which results were used last
+                os.utime(self.path(uid), (time.time(), stat.st_mtime))
+            except OSError:
+                pass
+        return buffer
+
+    def delete(self, uid):
+        self.remove(uid)
+
+    def __contains__(self, uid):
+        return self.stat(uid) is not None
+
+    def __len__(self):
+        return len(self.scan())
+
+    def write(self, uid, blob):
+        path = self.path(uid)
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+
+    def read(self, uid):
+        try:
+            with open(self.path(uid), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    def remove(self, uid):
+        try:
+            os.remove(self.path(uid))
+        except (OSError, ValueError):
+            pass
+
+    def getStats(self):
+        found = self.scan()
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "size": len(found),
+                    "bytes": sum(size for (used, uid, size) in found),
+                    "maxbytes": self.maxbytes}
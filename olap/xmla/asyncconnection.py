@@ -0,0 +1,212 @@
+'''
+The asyncio flavour of XMLAConnection, built on zeep's httpx based
+AsyncTransport. Discover, Execute, BeginSession and EndSession are
+coroutines, so many requests can be in flight on one event loop.
+'''
+import asyncio
+import logging
+
+import httpx
+from lxml.etree import XMLSyntaxError
+from zeep import AsyncClient
+from zeep.exceptions import Fault, TransportError
+from zeep.proxy import AsyncServiceProxy
+from zeep.transports import AsyncTransport
+
+from .cache import cacheCatalog
+from .connection import XMLAConnection, XMLASession, PoolStatsMixin, loadWsdl, faultDetail
+from .formatreader import RowsetReaderStreaming
+from .interfaces import XMLAException
+from .utils import *
+
+logger = logging.getLogger(__name__)
+
+# the connection limit of httpx clients created without limits
+DEFAULT_POOLSIZE = 100
+
+
+class AsyncXMLATransport(PoolStatsMixin, AsyncTransport):
+    """zeep async transport keeping track of how its connection pool is used."""
+
+    def __init__(self, pool_maxsize=DEFAULT_POOLSIZE, **kwargs):
+        super(AsyncXMLATransport, self).__init__(**kwargs)
+        self.initPoolStats(pool_maxsize)
+
+    async def post(self, address, message, headers):
+        self.requestStarted()
+        try:
+            return await super(AsyncXMLATransport, self).post(address, message, headers)
+        finally:
+            self.requestDone()
+
+    def idleConnections(self, address):
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        return len([conn for conn in getattr(pool, "connections", []) if conn.is_idle()])
+
+
+class AsyncXMLAConnection(XMLAConnection):
+    """
+    Takes the same options as XMLAConnection, except for session and auth
+    which have to be given for httpx: pass an httpx.AsyncClient of your own
+    as client or an httpx auth as auth.
+    """
+
+    def createTransport(self, sslverify, kwargs):
+        pool_maxsize = kwargs.pop("pool_maxsize", DEFAULT_POOLSIZE)
+        keepalive = kwargs.pop("keepalive", True)
+        limits = httpx.Limits(max_connections=pool_maxsize,
+                              max_keepalive_connections=pool_maxsize if keepalive else 0)
+        timeout = httpx.Timeout(kwargs.pop("read_timeout", None),
+                                connect=kwargs.pop("connect_timeout", None))
+        auth = kwargs.pop("auth", None)
+
+        client = kwargs.pop("client", None)
+        if client is None:
+            client = httpx.AsyncClient(verify=sslverify, auth=auth,
+                                       limits=limits, timeout=timeout)
+        return AsyncXMLATransport(client=client,
+                                  wsdl_client=httpx.Client(verify=sslverify, auth=auth),
+                                  pool_maxsize=pool_maxsize)
+
+    def createClient(self, url, **kwargs):
+        if self.wsdl_cache:
+            url = loadWsdl(url, kwargs["transport"])
+        elif url.startswith("file://"):
+            # httpx does not do file:// urls, zeep reads plain paths itself
+            url = url[len("file://"):]
+        return AsyncClient(url, **kwargs)
+
+    def createService(self, location):
+        self.binding = self.client.wsdl.bindings[ns_name(schema_xmla, "MsXmlAnalysisSoap")]
+        return AsyncServiceProxy(self.client, self.binding, address=location)
+
+    async def postMessage(self, operationName, message):
+        res = await self.transport.post(self.location, message, self.httpHeaders(operationName))
+        return self.readResponse(res)
+
+    async def close(self):
+        await self.transport.aclose()
+
+    async def callWithRetry(self, operation, **kw):
+        """Call operation, retrying it with exponential backoff on connection
+        errors and timeouts. Only use this for idempotent requests."""
+        attempt = 0
+        while True:
+            try:
+                return await operation(**kw)
+            except (httpx.NetworkError, httpx.TimeoutException) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning("xmla request failed (%s), retrying in %.1fs", e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def Discover(self, what, restrictions=None, properties=None):
+        key = self.discoverCacheKey(what, restrictions, properties)
+        if key is not None:
+            res = self.discover_cache.get(key)
+            if res is not None:
+                return res
+
+        message = self.requestMessage("Discover", (what, restrictions, properties))
+        try:
+            if message is not None:
+                res = self.readRowset(await self.callWithRetry(self.postMessage, operationName="Discover",
+                                                               message=message))
+            else:
+                rl = as_etree(restrictions, "RestrictionList")
+                pl = as_etree(properties, "PropertyList")
+                doc = await self.callWithRetry(self.service.Discover,
+                                               RequestType=what, Restrictions=rl, Properties=pl,
+                                               _soapheaders=self._soapheaders)
+                res = self.readDiscoverResponse(doc)
+        except Fault as fault:
+            raise XMLAException(fault.message, faultDetail(fault))
+        if key is not None:
+            self.discover_cache.set(key, res, cacheCatalog(restrictions, properties))
+        return res
+
+    async def iterDiscover(self, what, restrictions=None, properties=None):
+        message = self.discoverMessage(what, restrictions, properties)
+        reader = RowsetReaderStreaming()
+        self.transport.requestStarted()
+        try:
+            async with self.transport.client.stream("POST", self.location, content=message,
+                                                    headers=self.httpHeaders("Discover")) as res:
+                if res.status_code >= 400:
+                    await res.aread()
+                    self.readResponse(res)
+                try:
+                    async for chunk in res.aiter_bytes():
+                        for row in reader.feed(chunk):
+                            yield row
+                    for row in reader.close():
+                        yield row
+                except XMLSyntaxError:
+                    raise TransportError(status_code=res.status_code)
+        finally:
+            self.transport.requestDone()
+
+    async def Execute(self, command, dimformat="Multidimensional",
+                      axisFormat="TupleFormat", streaming=None, columnar=None, **kwargs):
+        key = self.executeCacheKey(command, dimformat, axisFormat, streaming, columnar, kwargs)
+        if key is None:
+            return await self.executeCommand(command, dimformat, axisFormat,
+                                             streaming, columnar, kwargs)
+        return await self.result_cache.fetchAsync(
+            key, lambda: self.executeCommand(command, dimformat, axisFormat,
+                                             streaming, columnar, kwargs))
+
+    async def executeCommand(self, command, dimformat, axisFormat, streaming, columnar, kwargs):
+        command, props, message, streaming, columnar = self.prepareExecute(command, dimformat, axisFormat,
+                                                                           streaming, columnar, kwargs)
+        if message is not None:
+            res = await self.transport.post(self.location, message, self.httpHeaders("Execute"))
+            if streaming:
+                return self.readStreamingResponse(res, columnar, dimformat)
+            return self.readExecuteRoot(self.readResponse(res), dimformat, columnar)
+
+        command, plist = self.executeArgs(command, props)
+        if streaming:
+            return await self.ExecuteStreaming(command, plist, columnar, dimformat)
+
+        try:
+            res = await self.service.Execute(Command=command, Properties=plist,
+                                             _soapheaders=self._soapheaders)
+            return self.readExecuteResponse(res, dimformat, columnar)
+        except Fault as fault:
+            raise XMLAException(fault.message, faultDetail(fault))
+
+    async def ExecuteStreaming(self, command, plist, columnar=False, dimformat="Multidimensional"):
+        # zeep's raw_response setting is thread local and would leak into
+        # the other tasks on the loop, so post the envelope ourselves
+        envelope = self.client.create_message(self.service, "Execute",
+                                              Command=command, Properties=plist,
+                                              _soapheaders=self._soapheaders)
+        res = await self.transport.post_xml(self.location, envelope, self.httpHeaders("Execute"))
+        return self.readStreamingResponse(res, columnar, dimformat)
+
+    async def BeginSession(self):
+        session = await self.openSession()
+        self.setSessionId(session.sessionId)
+        self._soapheaders = session.soapheaders
+
+    async def EndSession(self):
+        if self.sessionId is not None:
+            await self.closeSession(self.sessionId)
+            self.setSessionId(None)
+            self._soapheaders = None
+
+    async def openSession(self):
+        session = XMLASession(self)
+        token = self.opening.set(session)
+        try:
+            await self.service.Execute(Command=as_etree("Statement"), _soapheaders=self.beginSessionHeaders())
+        finally:
+            self.opening.reset(token)
+        session.soapheaders = self.sessionHeaders(session.sessionId)
+        return session
+
+    async def closeSession(self, sessionId):
+        await self.service.Execute(Command=as_etree("Statement"), _soapheaders=self.endSessionHeaders(sessionId))
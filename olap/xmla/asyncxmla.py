@@ -0,0 +1,200 @@
+'''
+The asyncio flavour of the XMLA provider.
+
+AsyncXMLAProvider().connect() returns an AsyncXMLASource, whose schema
+navigation mirrors XMLASource except that every call talking to the server
+has to be awaited, i.e.
+
+    s = AsyncXMLAProvider().connect(location="http://localhost:8080/mondrian/xmla")
+    cat = await s.getCatalog("FoodMart")
+    cube = await cat.getCube("Sales")
+    res = await cat.query("select ... from [Sales]")
+'''
+from .asyncconnection import AsyncXMLAConnection
+from .xmla import *
+
+
+class AsyncXMLAProvider(object):
+
+    def connect(self, url=defaultwsdl, location=None, sslverify=True, **kwargs):
+        return AsyncXMLASource(url, location, sslverify, **kwargs)
+
+
+class AsyncXMLAClass(XMLAClass):
+    __slots__ = ()
+
+    async def getSchemaElements(self, schemaElementName, unique_name,
+                                aslist=False, more_restrictions=None,
+                                more_properties=None,
+                                generate_instance=True):
+        func, r, properties = self.getSchemaRequest(schemaElementName, unique_name,
+                                                    more_restrictions, more_properties)
+        props = await func(r, properties)
+        return self.getSchemaResult(schemaElementName, props, r, properties,
+                                    aslist, generate_instance)
+
+    async def iterSchemaElements(self, schemaElementName, unique_name=None,
+                                 more_restrictions=None, more_properties=None,
+                                 generate_instance=True, batch_size=1000):
+        func, r, properties = self.getSchemaRequest(schemaElementName, unique_name,
+                                                    more_restrictions, more_properties)
+        what = rowsetmethods[schemaElementTypes[schemaElementName]["XMLA_FUNC"]]
+        batch = []
+        async for row in self._conn.iterDiscover(what, r, properties):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                for element in self.getSchemaBatch(schemaElementName, batch, generate_instance):
+                    yield element
+                batch = []
+        for element in self.getSchemaBatch(schemaElementName, batch, generate_instance):
+            yield element
+
+
+class AsyncXMLAMemberQueries(XMLAMemberQueries):
+    __slots__ = ()
+
+    async def queryMembers(self, setexpr):
+        res = await self._conn.Execute(self.membersQuery(setexpr), Catalog=self.CATALOG_NAME)
+        return self.membersResult(res)
+
+    async def queryGroups(self, members, setexpr):
+        found = []
+        for names in hierarchyGroups(members):
+            try:
+                found.extend(await self.queryMembers(setexpr(names)))
+            except XMLAException:
+                if len(names) == 1:
+                    raise
+                for n in names:
+                    found.extend(await self.queryMembers(setexpr([n])))
+        return found
+
+    async def getChildrenMany(self, members):
+        names = uniqueNames(members)
+        if not names:
+            return {}
+        return self.childrenResult(names, await self.queryGroups(members, self.childrenSet))
+
+    async def getAncestorsMany(self, members):
+        names = uniqueNames(members)
+        if not names:
+            return {}
+        return self.ancestorsResult(names, await self.queryGroups(members, self.ancestorsSet))
+
+
+class AsyncXMLASource(AsyncXMLAConnection, AsyncXMLAClass):
+
+    def __init__(self, urlwsdl=defaultwsdl,
+                 location=None,
+                 sslverify=True, **kwargs):
+        self.urlwsdl = urlwsdl
+        self.location = location
+        self.sslverify = sslverify
+
+        AsyncXMLAClass.__init__(self, None, {}, None, self)
+        AsyncXMLAConnection.__init__(self, urlwsdl, location, sslverify, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type=None, exc_value=None, traceback=None):
+        await self.close()
+
+    def getOLAPSource(self):
+        return self
+
+    def getCatalogs(self):
+        """Returns a list of catalogs in the Datasource."""
+        return self.getCatalog(None)
+
+    def getCatalog(self, unique_name):
+        return self.getSchemaElements("CATALOG", unique_name,
+                                      aslist=unique_name == None)
+
+
+class AsyncXMLACatalog(AsyncXMLAClass, XMLACatalog):
+    __slots__ = ()
+
+
+class AsyncXMLACube(AsyncXMLAClass, AsyncXMLAMemberQueries, XMLACube):
+    __slots__ = ()
+
+
+class AsyncXMLAHierarchy(AsyncXMLAClass, AsyncXMLAMemberQueries, XMLAHierarchy):
+    __slots__ = ()
+
+    async def getIndex(self, refresh=False):
+        if refresh or getattr(self, "_index", None) is None:
+            self._index = HierarchyIndex(await self.getMembers())
+        return self._index
+
+    async def refreshIndex(self, member=None):
+        if member is None or getattr(self, "_index", None) is None:
+            return await self.getIndex(refresh=True)
+        self._index.replaceSubtree(member, await self.getSubtree(member))
+        return self._index
+
+    async def getSubtree(self, member):
+        try:
+            return await self.getSchemaElements("TREE_MEMBER", uniqueNames([member])[0],
+                                                aslist=True,
+                                                more_restrictions={"TREE_OP": TREE_OP.SELF | TREE_OP.DESCENDANTS})
+        except SchemaElementNotFound:
+            return []
+
+
+class AsyncXMLALevel(AsyncXMLAClass, AsyncXMLAMemberQueries, XMLALevel):
+    __slots__ = ()
+
+
+class AsyncXMLAMember(AsyncXMLAClass, AsyncXMLAMemberQueries, XMLAMember):
+    __slots__ = ()
+
+    async def getParent(self):
+        """Return this members parent member or None if this is the root
+        already."""
+        pn = self.getParentName()
+        if pn:
+            return await self.getSchemaElements("TREE_MEMBER",
+                                                pn,
+                                                aslist=False)
+
+        return None
+
+    async def hasSiblings(self):
+        """Returns True if this member has siblings False otherwise."""
+        p = await self.getParent()
+        if p:
+            return int(p.CHILDREN_CARDINALITY) > 1
+        return len(await self.getSiblings()) > 0
+
+    async def getDescendants(self, depth=None):
+        if depth is None:
+            try:
+                return await self.getSchemaElements("TREE_MEMBER",
+                                                    self.getUniqueName(),
+                                                    aslist=True,
+                                                    more_restrictions={"TREE_OP": TREE_OP.DESCENDANTS})
+            except SchemaElementNotFound:
+                return []
+        return self.descendantsResult(await self.queryMembers(self.descendantsSet(depth)))
+
+
+class AsyncXMLAMeasure(AsyncXMLAClass, XMLAMeasure):
+    __slots__ = ()
+
+
+class AsyncXMLAProperty(AsyncXMLAClass, XMLAProperty):
+    __slots__ = ()
+
+
+class AsyncXMLASet(AsyncXMLAClass, XMLASet):
+    __slots__ = ()
+
+
+class AsyncXMLADimension(AsyncXMLAClass, XMLADimension):
+    __slots__ = ()
+
+
+AsyncXMLAClass.elementclasses = dict((name, globals()["Async" + name])
+                                     for name in XMLAClass.elementclasses)
@@ -0,0 +1,395 @@
+'''
+Caches for the rowsets returned by Discover and for Execute results.
+
+Schema metadata rarely changes, so the rows of a Discover can be kept and
+handed out again for the same request type, restrictions and properties.
+A cache is passed to the connection as discover_cache:
+
+    from olap.xmla.cache import MemoryCache
+    c = XMLAProvider().connect(location=..., discover_cache=MemoryCache(maxsize=1000, ttl=3600))
+    ...
+    c.invalidateCache("FoodMart")
+
+Results of identical MDX statements are cached by a ResultCache passed as
+result_cache.
+'''
+import asyncio
+import json
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cacheKey(what, restrictions=None, properties=None, identity=None):
+    """Return a string uniquely identifying a Discover request, identity
+    tells apart the servers and users asking (see authIdentity)."""
+    return json.dumps([identity, what, restrictions or {}, properties or {}],
+                      sort_keys=True, default=str)
+
+
+def authIdentity(auth):
+    """Return the user authenticating with auth (a requests or httpx auth or
+    a (user, password) tuple) for the cache keys. Auths without a known
+    user name only match themselves."""
+    if auth is None:
+        return None
+    if isinstance(auth, (tuple, list)):
+        return auth[0]
+    username = getattr(auth, "username", None)
+    if username is None:
+        username = getattr(auth, "_username", None)
+    if username is not None:
+        return username.decode("utf-8") if isinstance(username, bytes) else username
+    return "%s@%x" % (type(auth).__name__, id(auth))
+
+
+def cacheCatalog(restrictions=None, properties=None):
+    """Return the catalog a Discover request refers to, if any."""
+    catalog = (properties or {}).get("Catalog")
+    if catalog is None:
+        catalog = (restrictions or {}).get("CATALOG_NAME")
+    return catalog
+
+
+class DiscoverCache(object):
+    """
+    Base for the Discover caches, entries expire ttl seconds after they have
+    been stored (None to keep them until evicted) and at most maxsize entries
+    are kept, evicting the least recently used ones first.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def expires(self):
+        return None if self.ttl is None else time.time() + self.ttl
+
+    def get(self, key):
+        """Return the cached rows for key or None."""
+        raise NotImplementedError
+
+    def set(self, key, rows, catalog=None):
+        """Store rows under key, catalog is remembered for invalidate."""
+        raise NotImplementedError
+
+    def invalidate(self, catalog=None):
+        """Drop the entries of catalog or all entries if catalog is None."""
+        raise NotImplementedError
+
+    def size(self):
+        """Return the number of entries, the lock has to be held."""
+        raise NotImplementedError
+
+    def __len__(self):
+        with self.lock:
+            return self.size()
+
+    def getStats(self):
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "size": self.size(),
+                    "maxsize": self.maxsize}
+
+    def count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+
+class MemoryCache(DiscoverCache):
+    """Keeps the rowsets in process memory."""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        super(MemoryCache, self).__init__(maxsize, ttl)
+        # key -> (expires, catalog, rows), ordered by last use
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                del self.entries[key]
+                entry = None
+            self.count(entry is not None)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return list(entry[2])
+
+    def set(self, key, rows, catalog=None):
+        with self.lock:
+            self.entries[key] = (self.expires(), catalog, list(rows))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, catalog=None):
+        with self.lock:
+            if catalog is None:
+                self.entries.clear()
+            else:
+                for key in [k for (k, v) in self.entries.items() if v[1] == catalog]:
+                    del self.entries[key]
+
+    def size(self):
+        return len(self.entries)
+
+
+class SqliteCache(DiscoverCache):
+    """
+    Keeps the rowsets pickled in a sqlite database, so they survive restarts
+    and can be shared by the processes on a host.
+    """
+
+    def __init__(self, path, maxsize=10000, ttl=24 * 3600):
+        super(SqliteCache, self).__init__(maxsize, ttl)
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("CREATE TABLE IF NOT EXISTS discover ("
+                        "key TEXT PRIMARY KEY, catalog TEXT, expires REAL, "
+                        "used REAL, rows BLOB)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS discover_used ON discover (used)")
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT expires, rows FROM discover WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is not None and row[0] is not None and row[0] < now:
+                self.db.execute("DELETE FROM discover WHERE key = ?", (key,))
+                row = None
+            self.count(row is not None)
+            if row is None:
+                return None
+            self.db.execute("UPDATE discover SET used = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[1])
+
+    def set(self, key, rows, catalog=None):
+        blob = pickle.dumps(list(rows), pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO discover VALUES (?, ?, ?, ?, ?)",
+                            (key, catalog, self.expires(), time.time(), blob))
+            toomany = self.size() - self.maxsize
+            if toomany > 0:
+                self.db.execute("DELETE FROM discover WHERE key IN "
+                                "(SELECT key FROM discover ORDER BY used LIMIT ?)", (toomany,))
+                self.evictions += toomany
+
+    def invalidate(self, catalog=None):
+        with self.lock:
+            if catalog is None:
+                self.db.execute("DELETE FROM discover")
+            else:
+                self.db.execute("DELETE FROM discover WHERE catalog = ?", (catalog,))
+
+    def size(self):
+        return self.db.execute("SELECT COUNT(*) FROM discover").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+# bracketed identifiers (with ]] escaping a bracket), string literals,
+# comments, whitespace and everything else
+_mdxtokens = re.compile(r"""(\[(?:[^\]]|\]\])*\]|"[^"]*"|'[^']*'|/\*.*?(?:\*/|$)|(?:--|//)[^\n]*"""
+                        r"""|\s+|[^\s\["'/-]+|.)""", re.S)
+
+
+def normalizeMDX(statement):
+    """Return statement with comments dropped and whitespace collapsed, so
+    statements differing only in layout map to the same text."""
+    parts = []
+    for token in _mdxtokens.findall(statement):
+        if token.isspace() or token.startswith(("/*", "--", "//")):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(token)
+    return "".join(parts).strip()
+
+
+def isQuery(statement):
+    """Return if the MDX statement is a query (SELECT or WITH ... SELECT)
+    rather than a command changing state on the server."""
+    words = normalizeMDX(statement).split(None, 1)
+    return bool(words) and words[0].upper() in ("SELECT", "WITH")
+
+
+def resultCacheKey(statement, properties, columnar=False, identity=None):
+    """Return a string identifying an Execute of the MDX statement,
+    identity tells apart the servers and users asking (see authIdentity)."""
+    return json.dumps([identity, normalizeMDX(statement), properties, bool(columnar)],
+                      sort_keys=True, default=str)
+
+
+class _Flight(object):
+    """An Execute in progress other callers of the same statement wait for."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.blob = None
+        self.error = None
+
+
+class ResultCache(object):
+    """
+    Keeps the parsed results of Execute, pickled, in memory.
+
+    Entries expire ttl seconds after they have been stored (None to keep them
+    until evicted), the least recently used entries are evicted as soon as
+    all entries together take more than maxbytes. Concurrent requests for a
+    statement that is not cached yet wait for the first one to finish
+    instead of all going to the server.
+    """
+
+    def __init__(self, maxbytes=256 * 1024 * 1024, ttl=300):
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (expires, blob), ordered by last use
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.flights = {}
+        self.asyncflights = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """Return the pickled result for key or None, the lock has to be held."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.time():
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def remove(self, key):
+        (expires, blob) = self.entries.pop(key)
+        self.bytes -= len(blob)
+
+    def store(self, key, blob):
+        if len(blob) > self.maxbytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            expires = None if self.ttl is None else time.time() + self.ttl
+            self.entries[key] = (expires, blob)
+            self.bytes += len(blob)
+            while self.bytes > self.maxbytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def fetch(self, key, compute):
+        """Return the cached result for key, calling compute to get it if
+        there is none. Only one compute per key runs at a time."""
+        with self.lock:
+            blob = self.lookup(key)
+            if blob is not None:
+                self.hits += 1
+                return pickle.loads(blob)
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return pickle.loads(flight.blob)
+
+        try:
+            result = compute()
+            flight.blob = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            self.store(key, flight.blob)
+            return result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+
+    async def fetchAsync(self, key, compute):
+        """fetch for coroutine functions, the requests sharing a result
+        have to run on the same event loop."""
+        with self.lock:
+            blob = self.lookup(key)
+            if blob is not None:
+                self.hits += 1
+                return pickle.loads(blob)
+            future = self.asyncflights.get(key)
+            leader = future is None
+            if leader:
+                future = self.asyncflights[key] = asyncio.get_running_loop().create_future()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            try:
+                return pickle.loads(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # this request was cancelled itself
+                    raise
+            # the leading request was cancelled, take over
+            return await self.fetchAsync(key, compute)
+
+        try:
+            result = await compute()
+            blob = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            self.store(key, blob)
+            future.set_result(blob)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # the exception has been delivered if nobody else waits for it
+            future.exception()
+            raise
+        finally:
+            with self.lock:
+                del self.asyncflights[key]
+            # cancelled (or interrupted), release the requests waiting
+            if not future.done():
+                future.cancel()
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def getStats(self):
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "shared": self.shared,
+                    "evictions": self.evictions,
+                    "size": len(self.entries),
+                    "bytes": self.bytes,
+                    "maxbytes": self.maxbytes}
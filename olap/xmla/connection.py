@@ -3,25 +3,85 @@ Created on 18.04.2012
 
 @author: norman
 '''
+import contextvars
+import gc
 import logging
+import os
+import threading
+import time
 
+from lxml.etree import XMLSyntaxError
+import requests.exceptions
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
 from zeep import Client, Plugin
-from zeep.exceptions import Fault
+from zeep.exceptions import Fault, TransportError
 from zeep.transports import Transport
+from zeep.wsdl import Document
 
 # import types
-from .formatreader import TupleFormatReader, TupleFormatReaderTabular
+from .cache import MemoryCache, authIdentity, cacheKey, cacheCatalog, isQuery, resultCacheKey
+from .envelope import EnvelopeTemplate
+from .formatreader import TupleFormatReader, TupleFormatReaderTabular, TupleFormatReaderStreaming, \
+    TupleFormatReaderTabularStreaming, RowsetReaderStreaming, RowsetDecoder, faultException
 from .interfaces import XMLAException
 from .utils import *
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-schema_xmla = "urn:schemas-microsoft-com:xml-analysis"
-schema_xmla_rowset = "urn:schemas-microsoft-com:xml-analysis:rowset"
-schema_xmla_mddataset = "urn:schemas-microsoft-com:xml-analysis:mddataset"
-schema_soap_env = "http://schemas.xmlsoap.org/soap/envelope/"
-schema_xml = "http://www.w3.org/2001/XMLSchema"
+# parsed wsdl documents by url, shared by all connections of the process
+wsdlDocuments = {}
+wsdlLock = threading.Lock()
+
+
+def loadWsdl(url, transport):
+    """Return the parsed wsdl at url, parsing it (reading it through
+    transport) only the first time it is asked for."""
+    document = wsdlDocuments.get(url)
+    if document is None:
+        with wsdlLock:
+            document = wsdlDocuments.get(url)
+            if document is None:
+                # zeep reads local files itself, whatever the transport
+                location = url[len("file://"):] if url.startswith("file://") else url
+                document = wsdlDocuments[url] = Document(location, transport)
+    return document
+
+
+def preloadWsdl(url, freeze=False):
+    """
+    Parse the wsdl at url into the cache shared by the connections of the
+    process. Meant to be called by the master of a preforking server (e.g.
+    in gunicorn's on_starting hook), its workers then make connections
+    without parsing the wsdl and share its pages with the master.
+
+    freeze moves all objects alive so far out of reach of the garbage
+    collector (gc.freeze), collections in the workers would otherwise
+    touch and so copy the pages holding the parsed wsdl.
+    """
+    transport = Transport()
+    try:
+        document = loadWsdl(url, transport)
+    finally:
+        transport.session.close()
+    if freeze:
+        gc.freeze()
+    return document
+
+
+def clearWsdlCache():
+    """Forget the parsed wsdl documents, e.g. after the wsdl changed."""
+    with wsdlLock:
+        wsdlDocuments.clear()
+
+
+def afterFork():
+    # the lock may have been held by another thread of the parent
+    global wsdlLock
+    wsdlLock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=afterFork)
 
 
 # the following along with changes to the wsdl (elementFormDefault="unqualified") is needed
@@ -51,12 +111,133 @@ class SessionPlugin(Plugin):
 
     def ingress(self, envelope, http_headers, operation):
         # print(etree_tostring(envelope))
-        if self.xmlaconn.getListenOnSessionId():
+        # the session being opened by the calling thread or task, if any
+        session = self.xmlaconn.opening.get()
+        if session is not None or self.xmlaconn.getListenOnSessionId():
             nsmap = {'se': schema_soap_env,
                      'xmla': schema_xmla}
             s = envelope.xpath("/se:Envelope/se:Header/xmla:Session", namespaces=nsmap)[0]
             sid = s.attrib.get("SessionId")
-            self.xmlaconn.setSessionId(sid)
+            if session is not None:
+                session.sessionId = sid
+            else:
+                self.xmlaconn.setSessionId(sid)
+
+
+class XMLASession(object):
+    """
+    A session opened on the XMLA server. While a session is active on a
+    connection (see XMLAConnection.activateSession) the requests of the
+    activating thread or task are sent within the session.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.sessionId = None
+        self.soapheaders = None
+        self.created = time.time()
+        self.used = self.created
+
+    def __repr__(self):
+        return "<XMLASession %s>" % self.sessionId
+
+
+class PoolStatsMixin(object):
+    """
+    Keeps track of how the http connection pool of a transport is used.
+
+    waits counts the requests that were issued while already pool_maxsize
+    requests were in flight, i.e. had to wait for (or open) an additional
+    connection.
+    """
+
+    def initPoolStats(self, pool_maxsize):
+        self.pool_maxsize = pool_maxsize
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.waits = 0
+        self.requests = 0
+
+    def requestStarted(self):
+        with self.lock:
+            if self.in_use >= self.pool_maxsize:
+                self.waits += 1
+            self.in_use += 1
+            self.requests += 1
+
+    def requestDone(self):
+        with self.lock:
+            self.in_use -= 1
+
+    def idleConnections(self, address):
+        """Return the number of idle keep-alive connections pooled for the
+        host of address."""
+        return 0
+
+    def getPoolStats(self, address):
+        with self.lock:
+            stats = {"in_use": self.in_use,
+                     "waits": self.waits,
+                     "requests": self.requests,
+                     "pool_maxsize": self.pool_maxsize}
+        stats["idle"] = self.idleConnections(address)
+        return stats
+
+
+class XMLATransport(PoolStatsMixin, Transport):
+    """zeep transport keeping track of how its connection pool is used."""
+
+    def __init__(self, pool_maxsize=DEFAULT_POOLSIZE, **kwargs):
+        super(XMLATransport, self).__init__(**kwargs)
+        self.initPoolStats(pool_maxsize)
+
+    def post(self, address, message, headers):
+        self.requestStarted()
+        try:
+            return super(XMLATransport, self).post(address, message, headers)
+        finally:
+            self.requestDone()
+
+    def post_stream(self, address, message, headers):
+        """Post message and return the response without reading its body,
+        which has to be closed when done. The request counts as in flight
+        until then, as the body holds on to the pooled connection."""
+        self.requestStarted()
+        try:
+            res = self.session.post(address, data=message, headers=headers,
+                                    timeout=self.operation_timeout, stream=True)
+        except BaseException:
+            self.requestDone()
+            raise
+        close = res.close
+        closed = []
+
+        def closeResponse():
+            try:
+                close()
+            finally:
+                if not closed:
+                    closed.append(True)
+                    self.requestDone()
+
+        res.close = closeResponse
+        return res
+
+    def idleConnections(self, address):
+        adapter = self.session.get_adapter(address)
+        poolmanager = getattr(adapter, "poolmanager", None)
+        if poolmanager is None:
+            return 0
+        idle = 0
+        for key in list(poolmanager.pools.keys()):
+            pool = poolmanager.pools.get(key)
+            queue = getattr(pool, "pool", None)
+            if queue is not None:
+                # unused slots of the pool are filled with None,
+                # connections closed by the server have no socket anymore
+                idle += len([conn for conn in list(queue.queue)
+                             if getattr(conn, "sock", None) is not None])
+        return idle
 
 
 # lsit of XMLA1.1 rowsets: 
@@ -82,6 +263,72 @@ xmla1_1_rowsets = ["DISCOVER_DATASOURCES",
                    "MDSCHEMA_SETS"
                    ]
 
+# getMDSchemaCubes -> MDSCHEMA_CUBES
+# the arguments of the operations posted by the connection itself, from the
+# values handed to XMLAConnection.requestMessage
+operationArgs = {
+    "Discover": lambda what, restrictions, properties: {
+        "RequestType": what,
+        "Restrictions": as_etree(restrictions, "RestrictionList"),
+        "Properties": as_etree(properties, "PropertyList")},
+    "Execute": lambda command, properties: {
+        "Command": as_etree({"Statement": command}) if isinstance(command, stringtypes) else command,
+        "Properties": as_etree({"PropertyList": properties})},
+}
+
+scalartypes = stringtypes + (int, float)
+
+
+def argsShape(args):
+    """Return the shape of the arguments of a templated request, i.e. which
+    values are given, along with the given values as strings. The shape is
+    None if a value is not supported by templates."""
+    shape = []
+    values = []
+    for arg in args:
+        if isinstance(arg, dict):
+            keys = []
+            for (k, v) in arg.items():
+                if v is not None and not isinstance(v, scalartypes):
+                    return None, None
+                keys.append((k, v is not None))
+                if v is not None:
+                    values.append(str(v))
+            shape.append(tuple(keys))
+        elif arg is not None and not isinstance(arg, scalartypes):
+            return None, None
+        else:
+            shape.append(arg is not None)
+            if arg is not None:
+                values.append(str(arg))
+    return tuple(shape), values
+
+
+def fillArgs(args, values):
+    """Return args with the given values replaced by values, in argsShape
+    order."""
+    values = iter(values)
+    filled = []
+    for arg in args:
+        if isinstance(arg, dict):
+            arg = dict((k, None if v is None else next(values)) for (k, v) in arg.items())
+        elif arg is not None:
+            arg = next(values)
+        filled.append(arg)
+    return filled
+
+
+def faultDetail(fault):
+    """Return the detail of a zeep Fault as dict. For error responses not
+    being soap zeep hands over the body instead of a detail element."""
+    if isinstance(fault.detail, bytes):
+        return {"content": fault.detail.decode("utf-8", "replace")}
+    return dictify(fromETree(fault.detail, ns=None))
+
+
+rowsetmethods = dict((schemaNameToMethodName(schemaName), schemaName)
+                     for schemaName in xmla1_1_rowsets + ["MDSCHEMA_LEVELS"])
+
 
 class XMLAConnection(object):
 
@@ -92,9 +339,8 @@ class XMLAConnection(object):
     @classmethod
     def setupMembers(cls):
         def getFunc(schemaName):
-            return lambda this, *args, **kw: cls.Discover(this,
-                                                          schemaName,
-                                                          *args, **kw)
+            return lambda this, *args, **kw: this.Discover(schemaName,
+                                                           *args, **kw)
 
         for schemaName in xmla1_1_rowsets:
             mname = schemaNameToMethodName(schemaName)
@@ -102,19 +348,40 @@ class XMLAConnection(object):
 
     def __init__(self, url, location, sslverify, **kwargs):
 
-
-        if "session" in kwargs:
-            session = kwargs["session"]
-            del kwargs["session"]
-            transport = Transport(session=session)
-        else:
-            transport = Transport()
-
-        if "auth" in kwargs:
-            transport.session.auth = kwargs["auth"]
-            del kwargs["auth"]
-
-        transport.session.verify = sslverify
+        # who the cached responses belong to besides the location
+        self.cache_identity = kwargs.pop("cache_identity", None)
+        if self.cache_identity is None:
+            self.cache_identity = authIdentity(kwargs.get("auth") or
+                                               getattr(kwargs.get("session"), "auth", None))
+        transport = self.createTransport(sslverify, kwargs)
+
+        # Discover is idempotent, retry it on connection errors and timeouts
+        self.retries = kwargs.pop("retries", 0)
+        self.retry_backoff = kwargs.pop("retry_backoff", 0.5)
+        # read multidimensional Execute results straight from the http body
+        self.streaming = kwargs.pop("streaming", False)
+        # keep multidimensional cells in numpy arrays
+        self.columnar = kwargs.pop("columnar", False)
+        # cache for Discover rowsets, True for an in memory one
+        self.discover_cache = kwargs.pop("discover_cache", None)
+        if self.discover_cache is True:
+            self.discover_cache = MemoryCache()
+        # cache for the parsed results of MDX statements
+        self.result_cache = kwargs.pop("result_cache", None)
+
+        # the session the current thread or task works in, if not the
+        # one begun by BeginSession, and the one it is opening
+        self.activeSession = contextvars.ContextVar("activeSession", default=None)
+        self.opening = contextvars.ContextVar("opening", default=None)
+        self.soapheaders = None
+        # templates of the Discover and Execute envelopes by request shape,
+        # None to have zeep build all envelopes
+        self.templates = {} if kwargs.pop("soap_templates", False) else None
+        # post Discover and Execute requests and read their responses
+        # ourselves instead of through zeep, as filled in templates have to be
+        self.raw_transport = kwargs.pop("raw_transport", False) or self.templates is not None
+        # share the parsed wsdl with the other connections to the same url
+        self.wsdl_cache = kwargs.pop("wsdl_cache", True)
         self.sessionplugin = SessionPlugin(self)
         plugins = [self.sessionplugin]
 
@@ -125,13 +392,18 @@ class XMLAConnection(object):
             elif log == True:
                 plugins.append(LogRequest())
             del kwargs["log"]
-
-        self.client = Client(url,
-                             transport=transport,
-                             # cache=None, unwrap=False,
-                             plugins=plugins)
-
-        self.service = self.client.create_service(ns_name(schema_xmla, "MsXmlAnalysisSoap"), location)
+            # plugins only see the requests sent by zeep
+            self.templates = None
+            self.raw_transport = False
+
+        self.transport = transport
+        self.location = location
+        self.client = self.createClient(url,
+                                        transport=transport,
+                                        # cache=None, unwrap=False,
+                                        plugins=plugins)
+
+        self.service = self.createService(location)
         self.client.set_ns_prefix(None, schema_xmla)
         # optional, call might fail
         self.getMDSchemaLevels = lambda *args, **kw: self.Discover("MDSCHEMA_LEVELS",
@@ -140,6 +412,163 @@ class XMLAConnection(object):
         self.setSessionId(None)
         self._soapheaders = None
 
+    def createTransport(self, sslverify, kwargs):
+        """Create the zeep transport, consuming the transport related
+        options from kwargs."""
+
+        # connection pool sizing, only applied if asked for so a
+        # session passed in keeps its adapters otherwise
+        pool_options = {}
+        for option in ("pool_connections", "pool_maxsize", "pool_block"):
+            if option in kwargs:
+                pool_options[option] = kwargs.pop(option)
+
+        # (connect, read) timeout for the requests to the xmla server
+        timeout = (kwargs.pop("connect_timeout", None), kwargs.pop("read_timeout", None))
+        timeout = timeout if timeout != (None, None) else None
+
+        transport = XMLATransport(session=kwargs.pop("session", None),
+                                  operation_timeout=timeout,
+                                  pool_maxsize=pool_options.get("pool_maxsize", DEFAULT_POOLSIZE))
+        if pool_options:
+            adapter = HTTPAdapter(**pool_options)
+            transport.session.mount("http://", adapter)
+            transport.session.mount("https://", adapter)
+
+        if not kwargs.pop("keepalive", True):
+            transport.session.headers["Connection"] = "close"
+
+        if "auth" in kwargs:
+            transport.session.auth = kwargs["auth"]
+            del kwargs["auth"]
+
+        transport.session.verify = sslverify
+        return transport
+
+    def createClient(self, url, **kwargs):
+        if self.wsdl_cache:
+            url = loadWsdl(url, kwargs["transport"])
+        return Client(url, **kwargs)
+
+    def createService(self, location):
+        self.binding = self.client.wsdl.bindings[ns_name(schema_xmla, "MsXmlAnalysisSoap")]
+        return self.client.create_service(ns_name(schema_xmla, "MsXmlAnalysisSoap"), location)
+
+    def httpHeaders(self, operation):
+        """Return the http headers for posting a soap envelope of operation."""
+        return {"Content-Type": "text/xml; charset=utf-8",
+                "SOAPAction": '"%s"' % self.binding.get(operation).soapaction}
+
+    def createDiscoverMessage(self, what, restrictions, properties):
+        return self.client.create_message(self.service, "Discover",
+                                          RequestType=what,
+                                          Restrictions=as_etree(restrictions, "RestrictionList"),
+                                          Properties=as_etree(properties, "PropertyList"),
+                                          _soapheaders=self._soapheaders)
+
+    def renderMessage(self, operation, args, soapheaders):
+        envelope = self.client.create_message(self.service, operation, _soapheaders=soapheaders,
+                                              **operationArgs[operation](*args))
+        return etree.tostring(envelope, xml_declaration=True, encoding="utf-8")
+
+    def templateMessage(self, operation, args):
+        """Return the envelope of operation for args (see operationArgs)
+        from a template, or None if zeep has to build this one."""
+        if self.templates is None:
+            return None
+        headers = self._soapheaders
+        if headers is None:
+            sessionId = None
+        elif list(headers) == ["Session"]:
+            sessionId = headers["Session"].SessionId
+        else:
+            return None
+        (shape, values) = argsShape(args)
+        if shape is None:
+            return None
+        if sessionId is not None:
+            values.append(str(sessionId))
+        key = (operation, shape, sessionId is not None)
+        if key not in self.templates:
+            def render(markers):
+                headers = None if sessionId is None else self.sessionHeaders(markers[-1])
+                return self.renderMessage(operation, fillArgs(args, markers), headers)
+
+            self.templates[key] = EnvelopeTemplate.compile(render, len(values))
+        template = self.templates[key]
+        return None if template is None else template.render(values)
+
+    def requestMessage(self, operation, args):
+        """Return the envelope of operation for args as bytes, or None if
+        the request has to be sent through zeep."""
+        if not self.raw_transport:
+            return None
+        message = self.templateMessage(operation, args)
+        if message is None:
+            message = self.renderMessage(operation, args, self._soapheaders)
+        return message
+
+    def postMessage(self, operationName, message):
+        """Post an envelope of operation, return the element returned."""
+        res = self.transport.post(self.location, message, self.httpHeaders(operationName))
+        return self.readResponse(res)
+
+    def readResponse(self, res):
+        """Return the element in the return element of a soap response,
+        raise XMLAException for soap faults."""
+        parser = etree.XMLParser(remove_blank_text=True, remove_comments=True, resolve_entities=False)
+        try:
+            doc = etree.fromstring(res.content, parser=parser)
+        except XMLSyntaxError:
+            raise TransportError(status_code=res.status_code, content=res.content)
+        body = doc.find(ns_name(schema_soap_env, "Body"))
+        if body is None:
+            raise TransportError(status_code=res.status_code, content=res.content)
+        fault = body.find(ns_name(schema_soap_env, "Fault"))
+        if fault is not None:
+            raise faultException(fault)
+        if res.status_code >= 400:
+            raise TransportError(status_code=res.status_code, content=res.content)
+        # <XResponse><return><root>
+        elem = body
+        for i in range(3):
+            elem = next(elem.iterchildren(etree.Element), None)
+            if elem is None:
+                return None
+        return elem
+
+    def checkStatus(self, res):
+        """Raise the error of a response with an error status whose body has
+        not been read yet, instead of parsing it as result: the soap fault
+        as XMLAException or a TransportError for anything else."""
+        if res.status_code < 400:
+            return
+        try:
+            # readResponse raises for any response with an error status
+            self.readResponse(res)
+        finally:
+            res.close()
+
+    @property
+    def _soapheaders(self):
+        session = self.activeSession.get()
+        return self.soapheaders if session is None else session.soapheaders
+
+    @_soapheaders.setter
+    def _soapheaders(self, value):
+        self.soapheaders = value
+
+    def activateSession(self, session):
+        """Send the requests of the calling thread or task within session,
+        None to go back to the session of the connection. Returns a token
+        to pass to deactivateSession."""
+        if session is not None:
+            session.used = time.time()
+        return self.activeSession.set(session)
+
+    def deactivateSession(self, token):
+        self.activeSession.reset(token)
+
     def getListenOnSessionId(self):
         return self.listenOnSessionId
 
@@ -149,60 +578,274 @@ class XMLAConnection(object):
     def setSessionId(self, sessionId):
         self.sessionId = sessionId
 
+    def getPoolStats(self):
+        """Return usage statistics of the http connection pool, i.e. the
+        number of requests in flight (in_use), idle pooled connections,
+        requests that had to wait for a connection and the total number
+        of requests issued."""
+        return self.transport.getPoolStats(self.location)
+
+    def callWithRetry(self, operation, **kw):
+        """Call operation, retrying it with exponential backoff on connection
+        errors and timeouts. Only use this for idempotent requests."""
+        attempt = 0
+        while True:
+            try:
+                return operation(**kw)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning("xmla request failed (%s), retrying in %.1fs", e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def discoverCacheKey(self, what, restrictions, properties):
+        """Return the key to cache the Discover under or None if it
+        shouldn't be cached."""
+        # within a session the schema may contain session scoped objects
+        if self.discover_cache is None or self._soapheaders is not None:
+            return None
+        return cacheKey(what, restrictions, properties, [self.location, self.cache_identity])
+
+    def invalidateCache(self, catalog=None):
+        """Drop the cached Discover rowsets of catalog, or all of them."""
+        if self.discover_cache is not None:
+            self.discover_cache.invalidate(catalog)
+
+    def getCacheStats(self):
+        """Return hit/miss counters and size of the Discover cache."""
+        if self.discover_cache is None:
+            return None
+        return self.discover_cache.getStats()
+
+    def executeCacheKey(self, command, dimformat, axisFormat, streaming, columnar, kwargs):
+        """Return the key to cache the result of an Execute under or None
+        if it shouldn't be cached."""
+        # session scoped calculated members and sets may change the result,
+        # streamed tabular results are read from the response when used,
+        # commands like CREATE MEMBER or REFRESH CUBE have to reach the server
+        if self.result_cache is None or self._soapheaders is not None \
+                or not isinstance(command, stringtypes) or not isQuery(command) \
+                or (dimformat == "Tabular" and streaming):
+            return None
+        props = {"Format": dimformat, "AxisFormat": axisFormat}
+        props.update(kwargs)
+        return resultCacheKey(command, props, self.columnar if columnar is None else columnar,
+                              [self.location, self.cache_identity])
+
+    def getResultCacheStats(self):
+        """Return hit/miss counters and size of the Execute result cache."""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.getStats()
+
     def Discover(self, what, restrictions=None, properties=None):
-        rl = as_etree(restrictions, "RestrictionList")
-        pl = as_etree(properties, "PropertyList")
+        key = self.discoverCacheKey(what, restrictions, properties)
+        if key is not None:
+            res = self.discover_cache.get(key)
+            if res is not None:
+                return res
+
+        message = self.requestMessage("Discover", (what, restrictions, properties))
         try:
-            # import pdb; pdb.set_trace()
-            doc = self.service.Discover(RequestType=what, Restrictions=rl, Properties=pl,
-                                        _soapheaders=self._soapheaders)
-            root = fromETree(doc.body["return"]["_value_1"], ns=schema_xmla_rowset)
-            res = getattr(root, "row", [])
-            if res:
-                res = aslist(res)
+            if message is not None:
+                res = self.readRowset(self.callWithRetry(self.postMessage, operationName="Discover",
+                                                         message=message))
+            else:
+                rl = as_etree(restrictions, "RestrictionList")
+                pl = as_etree(properties, "PropertyList")
+                # import pdb; pdb.set_trace()
+                doc = self.callWithRetry(self.service.Discover,
+                                         RequestType=what, Restrictions=rl, Properties=pl,
+                                         _soapheaders=self._soapheaders)
+                res = self.readDiscoverResponse(doc)
         except Fault as fault:
-            raise XMLAException(fault.message, dictify(fromETree(fault.detail, ns=None)))
+            raise XMLAException(fault.message, faultDetail(fault))
         # logger.debug( res )
+        if key is not None:
+            self.discover_cache.set(key, res, cacheCatalog(restrictions, properties))
         return res
 
-    def Execute(self, command, dimformat="Multidimensional",
-                axisFormat="TupleFormat", **kwargs):
-        if isinstance(command, stringtypes):
-            command = as_etree({"Statement": command})
+    def iterDiscover(self, what, restrictions=None, properties=None, chunk_size=64 * 1024):
+        """Like Discover, but yield the rows while they are read from the
+        response, so rowsets of any size can be scanned in constant memory.
+        The rows are not cached."""
+        message = self.discoverMessage(what, restrictions, properties)
+        res = self.callWithRetry(self.transport.post_stream, address=self.location,
+                                 message=message, headers=self.httpHeaders("Discover"))
+        self.checkStatus(res)
+        reader = RowsetReaderStreaming()
+        try:
+            for chunk in res.iter_content(chunk_size):
+                for row in reader.feed(chunk):
+                    yield row
+            for row in reader.close():
+                yield row
+        except XMLSyntaxError:
+            raise TransportError(status_code=res.status_code)
+        finally:
+            res.close()
+
+    def discoverMessage(self, what, restrictions, properties):
+        """Return the Discover envelope as bytes."""
+        message = self.templateMessage("Discover", (what, restrictions, properties))
+        if message is None:
+            message = etree.tostring(self.createDiscoverMessage(what, restrictions, properties))
+        return message
+
+    def readDiscoverResponse(self, doc):
+        return self.readRowset(doc.body["return"]["_value_1"])
+
+    def readRowset(self, root):
+        if root is None:
+            return []
+        return RowsetDecoder(root).decodeRows(root)
+
+    def prepareExecute(self, command, dimformat, axisFormat, streaming, columnar, kwargs):
+        """Return the command, the properties for an Execute request and its
+        envelope unless it goes through zeep, along with the effective
+        streaming and columnar settings."""
         props = {"Format": dimformat, "AxisFormat": axisFormat}
         props.update(kwargs)
 
-        plist = as_etree({"PropertyList": props})
-        ns = schema_xmla_mddataset if dimformat == "Multidimensional" else schema_xmla_rowset
-        reader = TupleFormatReader if dimformat == "Multidimensional" else TupleFormatReaderTabular
+        message = self.requestMessage("Execute", (command, props))
+        if dimformat == "Tabular":
+            # the rows can be read only once then, so only if asked for
+            streaming = bool(streaming)
+        elif streaming is None:
+            streaming = self.streaming
+        if columnar is None:
+            columnar = self.columnar
+        return command, props, message, streaming and dimformat in ("Multidimensional", "Tabular"), columnar
+
+    def executeArgs(self, command, props):
+        """Return the Command and Properties elements for an Execute."""
+        if isinstance(command, stringtypes):
+            command = as_etree({"Statement": command})
+        return command, as_etree({"PropertyList": props})
+
+    def Execute(self, command, dimformat="Multidimensional",
+                axisFormat="TupleFormat", streaming=None, columnar=None, **kwargs):
+        key = self.executeCacheKey(command, dimformat, axisFormat, streaming, columnar, kwargs)
+        if key is None:
+            return self.executeCommand(command, dimformat, axisFormat, streaming, columnar, kwargs)
+        return self.result_cache.fetch(key, lambda: self.executeCommand(command, dimformat, axisFormat,
+                                                                        streaming, columnar, kwargs))
+
+    def executeCommand(self, command, dimformat, axisFormat, streaming, columnar, kwargs):
+        command, props, message, streaming, columnar = self.prepareExecute(command, dimformat, axisFormat,
+                                                                           streaming, columnar, kwargs)
+        if message is not None:
+            if streaming:
+                res = self.transport.post_stream(self.location, message, self.httpHeaders("Execute"))
+                return self.readStreamedResponse(res, dimformat, columnar)
+            res = self.transport.post(self.location, message, self.httpHeaders("Execute"))
+            return self.readExecuteRoot(self.readResponse(res), dimformat, columnar)
+
+        command, plist = self.executeArgs(command, props)
+        if streaming:
+            return self.ExecuteStreaming(command, plist, columnar, dimformat)
+
         try:
 
             res = self.service.Execute(Command=command, Properties=plist, _soapheaders=self._soapheaders)
-            root = res.body["return"]["_value_1"]
-            cols = None if dimformat == "Multidimensional" else fromETree(root, ns=schema_xml, name="schema")
-            rows = fromETree(root, ns=ns)
-            return reader(rows, cols)
+            return self.readExecuteResponse(res, dimformat, columnar)
         except Fault as fault:
-            raise XMLAException(fault.message, dictify(fromETree(fault.detail, ns=None)))
-
-    def BeginSession(self):
-        bs = self.client.get_element(ns_name(schema_xmla, "BeginSession"))(mustUnderstand=1)
-        self.setListenOnSessionId(True)
-        cmd = as_etree("Statement")
+            raise XMLAException(fault.message, faultDetail(fault))
+
+    def readExecuteResponse(self, res, dimformat, columnar):
+        return self.readExecuteRoot(res.body["return"]["_value_1"], dimformat, columnar)
+
+    def readExecuteRoot(self, root, dimformat, columnar):
+        """Return the result read from root, None for commands without
+        result like CREATE MEMBER."""
+        if root is None:
+            raise XMLAException("The Execute response holds no result.", {})
+        if root.tag == ns_name(schema_xmla_empty, "root"):
+            return None
+        if dimformat == "Multidimensional":
+            return TupleFormatReader(fromETree(root, ns=schema_xmla_mddataset), columnar=columnar)
+        return TupleFormatReaderTabular(root)
+
+    def ExecuteStreaming(self, command, plist, columnar=False, dimformat="Multidimensional"):
+        """Execute the command and hand the raw response body to a
+        TupleFormatReaderStreaming (or TupleFormatReaderTabularStreaming),
+        bypassing zeep's response parsing."""
+        with self.client.settings(raw_response=True):
+            res = self.service.Execute(Command=command, Properties=plist, _soapheaders=self._soapheaders)
+        return self.readStreamingResponse(res, columnar, dimformat)
 
-        self.service.Execute(Command=cmd, _soapheaders={"BeginSession": bs})
-        self.setListenOnSessionId(False)
+    def readStreamingResponse(self, res, columnar, dimformat="Multidimensional"):
+        if res.status_code >= 400:
+            self.readResponse(res)
+        try:
+            if dimformat == "Tabular":
+                return TupleFormatReaderTabularStreaming(res.content)
+            reader = TupleFormatReaderStreaming(res.content, columnar=columnar)
+            return None if reader.empty else reader
+        except XMLSyntaxError:
+            # not a soap response at all, e.g. an error page from a proxy
+            raise TransportError(status_code=res.status_code, content=res.content)
+
+    def readStreamedResponse(self, res, dimformat, columnar):
+        """Like readStreamingResponse, but for a response whose body has not
+        been read yet, it's parsed while being received. Tabular results
+        keep the response open until their rows have been read."""
+        self.checkStatus(res)
+        res.raw.decode_content = True
+        if dimformat == "Tabular":
+            try:
+                return TupleFormatReaderTabularStreaming(res.raw, close=res.close)
+            except XMLSyntaxError:
+                raise TransportError(status_code=res.status_code)
+        try:
+            reader = TupleFormatReaderStreaming(res.raw, columnar=columnar)
+            return None if reader.empty else reader
+        except XMLSyntaxError:
+            raise TransportError(status_code=res.status_code)
+        finally:
+            res.close()
 
-        sess = self.client.get_element(ns_name(schema_xmla, "Session"))(SessionId=self.sessionId, mustUnderstand=1)
-        self._soapheaders = {"Session": sess}
+    def BeginSession(self):
+        session = self.openSession()
+        self.setSessionId(session.sessionId)
+        self._soapheaders = session.soapheaders
 
     def EndSession(self):
         if self.sessionId is not None:
-            es = self.client.get_element(ns_name(schema_xmla, "EndSession"))(SessionId=self.sessionId, mustUnderstand=1)
-            cmd = as_etree("Statement")
-            self.service.Execute(Command=cmd, _soapheaders={"EndSession": es})
+            self.closeSession(self.sessionId)
             self.setSessionId(None)
             self._soapheaders = None
 
+    def beginSessionHeaders(self):
+        bs = self.client.get_element(ns_name(schema_xmla, "BeginSession"))(mustUnderstand=1)
+        return {"BeginSession": bs}
+
+    def sessionHeaders(self, sessionId):
+        sess = self.client.get_element(ns_name(schema_xmla, "Session"))(SessionId=sessionId,
+                                                                         mustUnderstand=1)
+        return {"Session": sess}
+
+    def endSessionHeaders(self, sessionId):
+        es = self.client.get_element(ns_name(schema_xmla, "EndSession"))(SessionId=sessionId, mustUnderstand=1)
+        return {"EndSession": es}
+
+    def openSession(self):
+        """Begin a new session on the server and return it as XMLASession,
+        leaving the session of the connection alone."""
+        session = XMLASession(self)
+        token = self.opening.set(session)
+        try:
+            self.service.Execute(Command=as_etree("Statement"), _soapheaders=self.beginSessionHeaders())
+        finally:
+            self.opening.reset(token)
+        session.soapheaders = self.sessionHeaders(session.sessionId)
+        return session
+
+    def closeSession(self, sessionId):
+        """End the session sessionId on the server."""
+        self.service.Execute(Command=as_etree("Statement"), _soapheaders=self.endSessionHeaders(sessionId))
+
 
 XMLAConnection.setupMembers()
@@ -0,0 +1,64 @@
+'''
+Byte level templates of the SOAP envelopes sent for Discover and Execute.
+
+A template is made by letting zeep render the envelope once, with marker
+strings in place of the values, and cutting the result at the markers.
+Requests of the same shape then just join the template's parts with the
+escaped values, skipping zeep's object model and serializer.
+'''
+import re
+import uuid
+
+
+def escapeText(value):
+    """Escape value for element content the way lxml does."""
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
+
+
+def escapeAttribute(value):
+    """Escape value for a double quoted attribute value."""
+    return escapeText(value).replace('"', "&quot;").replace("\n", "&#10;").replace("\t", "&#9;")
+
+
+class EnvelopeTemplate(object):
+    """
+    The parts of an envelope between its values, values are filled in in
+    the order they were handed to render when the template was compiled.
+    """
+
+    def __init__(self, parts, slots):
+        self.parts = parts
+        # for each gap between two parts: (index of the value, escape function)
+        self.slots = slots
+
+    @classmethod
+    def compile(cls, render, count):
+        """Return the template for the envelopes render(values) returns as
+        bytes for count values, None if the values can't be told apart in
+        the rendered envelope."""
+        token = uuid.uuid4().hex
+        markers = ["olap%s%d" % (token, i) for i in range(count)]
+        envelope = render(markers)
+        found = [(m.start(), m.end(), int(m.group(1)))
+                 for m in re.finditer(("olap%s([0-9]+)" % token).encode("ascii"), envelope)]
+        if sorted(i for (start, end, i) in found) != list(range(count)):
+            return None
+        parts = []
+        slots = []
+        pos = 0
+        for (start, end, i) in found:
+            parts.append(envelope[pos:start])
+            inattribute = envelope[start - 1:start] == b'"' and envelope[end:end + 1] == b'"'
+            slots.append((i, escapeAttribute if inattribute else escapeText))
+            pos = end
+        parts.append(envelope[pos:])
+        return cls(parts, slots)
+
+    def render(self, values):
+        """Return the envelope for values (strings) as utf-8 bytes."""
+        parts = self.parts
+        chunks = [parts[0]]
+        for (n, (i, escape)) in enumerate(self.slots):
+            chunks.append(escape(values[i]).encode("utf-8"))
+            chunks.append(parts[n + 1])
+        return b"".join(chunks)
@@ -0,0 +1,131 @@
+'''
+Running many independent MDX statements at the same time.
+
+A zeep client is not meant to be shared by threads, so each worker thread of
+an ExecutorPool gets a connection of its own, made by the function passed
+to the pool:
+
+    from olap.xmla.executor import ExecutorPool
+
+    p = XMLAProvider()
+    with ExecutorPool(lambda: p.connect(location=...), max_workers=8) as pool:
+        for job in pool.executeMany([("FoodMart", mdx1), ("FoodMart", mdx2, {"dimformat": "Tabular"})]):
+            print(job.statement, job.getElapsed(), job.getResult())
+'''
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class Job(object):
+    """
+    An MDX statement run by an ExecutorPool, along with its result or the
+    exception raised executing it and when it was submitted, started and
+    finished (time.time()).
+    properties are passed to Execute as keyword arguments.
+    """
+
+    def __init__(self, catalog, statement, properties=None):
+        self.catalog = catalog
+        self.statement = statement
+        self.properties = properties or {}
+        self.result = None
+        self.error = None
+        self.submitted = None
+        self.started = None
+        self.finished = None
+
+    def getResult(self):
+        """Return the result, raise the exception if executing failed."""
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def getElapsed(self):
+        """Return the seconds the statement took to execute."""
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def getWaited(self):
+        """Return the seconds the statement waited for a free worker."""
+        if self.started is None:
+            return None
+        return self.started - self.submitted
+
+    def __repr__(self):
+        return "<Job %s %r>" % (self.catalog, self.statement)
+
+
+class ExecutorPool(object):
+    """
+    Executes MDX statements on at most max_workers threads. connect is
+    called without arguments by each worker thread to create the connection
+    it uses, e.g. XMLAProvider().connect with bound arguments. Pass the same
+    discover_cache/result_cache to all connections to share them.
+    """
+
+    def __init__(self, connect, max_workers=8):
+        self.connect = connect
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="xmla")
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def getConnection(self):
+        """Return the connection of the calling worker thread."""
+        conn = getattr(self.local, "connection", None)
+        if conn is None:
+            conn = self.local.connection = self.connect()
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def run(self, job):
+        job.started = time.time()
+        try:
+            kwargs = dict(job.properties)
+            if job.catalog is not None:
+                kwargs["Catalog"] = job.catalog
+            job.result = self.getConnection().Execute(job.statement, **kwargs)
+        except Exception as e:
+            job.error = e
+        finally:
+            job.finished = time.time()
+        return job
+
+    def submit(self, catalog, statement, properties=None):
+        """Queue statement for execution, return a future for its Job. The
+        future doesn't fail if executing does, the Job holds the exception."""
+        return self.submitJob(Job(catalog, statement, properties))
+
+    def submitJob(self, job):
+        job.submitted = time.time()
+        return self.executor.submit(self.run, job)
+
+    def submitMany(self, jobs):
+        """Queue jobs, given as Jobs or (catalog, statement[, properties])
+        tuples, return the futures of their Jobs in the order given."""
+        return [self.submitJob(job if isinstance(job, Job) else Job(*job)) for job in jobs]
+
+    def executeMany(self, jobs, timeout=None):
+        """Execute jobs (see submitMany) and yield their Jobs as they
+        complete. Raises concurrent.futures.TimeoutError if not all of them
+        completed within timeout seconds."""
+        for future in as_completed(self.submitMany(jobs), timeout):
+            yield future.result()
+
+    def shutdown(self, wait=True):
+        """Stop the workers and close the connections they made."""
+        self.executor.shutdown(wait)
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.transport.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
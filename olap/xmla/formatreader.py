@@ -1,26 +1,181 @@
+import itertools
+import operator
+from collections import deque
+from io import BytesIO
+
 import zope.interface
 
 from olap.interfaces import IMDXResult
+from .interfaces import XMLAException
 from .utils import *
+from .utils import _missing
+
+# imported on first use, importing them takes longer than the rest of olap.xmla
+NUMPY = installed("numpy")
+numpy = LazyModule("numpy")
+ARROW = installed("pyarrow")
+pyarrow = LazyModule("pyarrow")
+
+
+class ColumnarCellStore(object):
+    """
+    Holds the cells of a multidimensional result column wise in numpy arrays
+    indexed by cell ordinal.
+
+    A numeric Value goes into a float64 array (NaN for missing cells), every
+    other cell property into an object array (None for missing cells).
+    mask tells which ordinals were actually sent by the server.
+    The store can be used in place of the dict mapping ordinals to cells.
+    """
+
+    def __init__(self, size):
+        if not NUMPY:
+            raise ImportError("The columnar cell store needs numpy installed.")
+        self.size = size
+        self.mask = numpy.zeros(size, dtype=bool)
+        self.columns = {}
+
+    def column(self, prop):
+        """Return the array for property prop, missing properties
+        yield an array of None."""
+        col = self.columns.get(prop)
+        if col is None:
+            col = numpy.full(self.size, None, dtype=object)
+        return col
+
+    def setCell(self, ordinal, cell):
+        for (prop, value) in cell.items():
+            if prop == "text" or prop.startswith("_"):
+                continue
+            col = self.columns.get(prop)
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if col is None:
+                if prop == "Value" and numeric:
+                    col = numpy.full(self.size, numpy.nan)
+                else:
+                    col = numpy.full(self.size, None, dtype=object)
+                self.columns[prop] = col
+            elif col.dtype != object and not numeric:
+                # a non numeric value showed up, fall back to an object column
+                col = col.astype(object)
+                col[~self.mask] = None
+                self.columns[prop] = col
+            col[ordinal] = value
+        self.mask[ordinal] = True
+
+    def get(self, ordinal, default=None):
+        if not self.mask[ordinal]:
+            return default
+        cell = Data(_CellOrdinal=str(ordinal))
+        for (prop, col) in self.columns.items():
+            value = col[ordinal]
+            if value is None or (col.dtype != object and numpy.isnan(value)):
+                continue
+            cell[prop] = value.item() if isinstance(value, numpy.generic) else value
+        return cell
 
 
 @zope.interface.implementer(IMDXResult)
 class TupleFormatReader(object):
 
-    def __init__(self, tupleresult, cols=None):
+    def __init__(self, tupleresult, cols=None, columnar=False):
         self.root = tupleresult
         self.cols = cols
+        self.columnar = columnar
         self.cellmap = self.mapOrdinalsToCells()
         
     def mapOrdinalsToCells(self):
-        "Return a dict mapping ordinals to cells"
-        m = {}
+        """Return a dict mapping ordinals to cells, or a ColumnarCellStore
+        if the result is read columnar."""
+        m = ColumnarCellStore(self.getCellCount()) if self.columnar else {}
         # "getattr" for the case where there are no cells
         # aslist if there is only one cell
         for cell in aslist(getattr(self.root.CellData, "Cell", [])):
-            m[int(cell._CellOrdinal)] = cell
+            if self.columnar:
+                m.setCell(int(cell._CellOrdinal), cell)
+            else:
+                m[int(cell._CellOrdinal)] = cell
             
         return m
+
+    def getAxes(self):
+        """Return the axes of the result without the SlicerAxis."""
+        axlist = aslist(getattr(self.root.Axes, "Axis", []))
+        return [ax for ax in axlist if ax._name != "SlicerAxis"]
+
+    def getTupleCount(self, ax):
+        return len(aslist(getattr(ax.Tuples, "Tuple", [])))
+
+    def getCellCount(self):
+        """Return the number of cells spanned by the axes."""
+        count = 1
+        for ax in self.getAxes():
+            count = count * self.getTupleCount(ax)
+        return count
+
+    def getAxisIndices(self, **kw):
+        """Return per axis (Axis0...AxisN) the list of tuple indices
+        selected by the keyword arguments of getSlice.
+
+        An axis may be selected by an index, a list of indices, a slice
+        object or a boolean mask with one entry per tuple."""
+        indices = []
+        for ax in self.getAxes():
+            maxtups = self.getTupleCount(ax)
+            if ax._name in kw:
+                indexrange = kw[ax._name]
+                if hasattr(indexrange, "tolist"):
+                    # numpy arrays and scalars
+                    indexrange = indexrange.tolist()
+                if isinstance(indexrange, bool):
+                    raise ValueError(
+                        "A boolean is no valid selection for axis '%s'" % ax._name)
+                if isinstance(indexrange, int):
+                    indexrange = [indexrange]
+                elif isinstance(indexrange, slice):
+                    indexrange = list(range(maxtups))[indexrange]
+                elif indexrange and all(isinstance(idx, bool) for idx in indexrange):
+                    if len(indexrange) != maxtups:
+                        raise ValueError(
+                            "The mask for axis '%s' has %d entries, but there are %d tuples" % \
+                                (ax._name, len(indexrange), maxtups))
+                    indexrange = [idx for (idx, selected) in enumerate(indexrange) if selected]
+                toolarge = [idx for idx in indexrange if idx >= maxtups or idx < 0]
+                if toolarge:
+                    raise ValueError(
+                        "The tuple requested do not exist on axis '%s': %s" % \
+                            (ax._name, indexrange))
+            else:
+                indexrange = list(range(maxtups))
+            indices.append(indexrange)
+        return indices
+
+    def getColumnarSlice(self, properties, **kw):
+        """getSlice for results read into a ColumnarCellStore.
+
+        Returns a numpy array shaped (AxisN, ..., Axis1, Axis0) for a single
+        property or a dict mapping property names to such arrays.
+        """
+        shape, selection = self._columnarSelection(**kw)
+
+        def column(prop):
+            return self.cellmap.column(prop).reshape(shape)[selection]
+
+        if isinstance(properties, stringtypes):
+            return column(properties)
+        return dict((prop, column(prop)) for prop in aslist(properties))
+
+    def getCellMask(self, **kw):
+        """Return a boolean numpy array telling which cells of the slice
+        were sent by the server (columnar results only)."""
+        shape, selection = self._columnarSelection(**kw)
+        return self.cellmap.mask.reshape(shape)[selection]
+
+    def _columnarSelection(self, **kw):
+        # ordinals run fastest along Axis0, so the flat columns reshape
+        # to the reversed tuple counts
+        shape = tuple(reversed([self.getTupleCount(ax) for ax in self.getAxes()]))
+        return shape, numpy.ix_(*reversed(self.getAxisIndices(**kw)))
     
     def getCellByOrdinal(self, ordinal):
         return self.cellmap.get(ordinal, {})
@@ -45,7 +200,8 @@ class TupleFormatReader(object):
         
     def getSlice(self, properties=None, **kw):
         """
-        getSlice(property=None [,Axis<Number>=n|Axis<Number>=[i1,i2,..,ix]])
+        getSlice(property=None [,Axis<Number>=n|Axis<Number>=[i1,i2,..,ix]|
+                                 Axis<Number>=slice(..)|Axis<Number>=[True,False,..]])
         
         Return the resulting cells from a MDX statement. 
         The result is presented as an array of arrays of arrays of... 
@@ -61,6 +217,8 @@ class TupleFormatReader(object):
         result.getSlice(Axis1=[1,2]) # return the data sliced at the 2nd and 3rd row
         result.getSlice(Axis0=3, Axis1=[1,2]) # return the data sliced at the 2nd and 
                                                 3rd row in addition to the 4th column
+        result.getSlice(Axis0=slice(0, 10, 2)) # every other of the first 10 columns
+        result.getSlice(Axis1=[True, False, True]) # select rows by a boolean mask
         
         If you do not want the whole cell returned but just a single property of it 
         (like the Value) name that property in the property parameter:
@@ -69,126 +227,617 @@ class TupleFormatReader(object):
         result.getSlice(properties="Value") 
         # from all the cells just get me the Value property
         result.getSlice(properties=["Value", "FmtValue"]) 
+
+        If the result has been read columnar the properties are returned as
+        numpy arrays shaped by the tuple counts of the axes (AxisN,...,Axis0),
+        a list of properties gives a dict of such arrays.
         
         """
-        axisranges = [] # list per axis the element indices to include
-        
-        #n.b: this assumes, axis are listed from Axis0,...AxisN in the ExecuteResponse, 
-        #otherwise the ordinal values would be useless anyway
-        
-        # at this offset we find the first requested index of the dimension
-        firstindexoffset=2
-        hyperelemcount=1
-        
-        axlist= aslist(getattr(self.root.Axes, "Axis", []))
-        # filter out possible SlicerAxis
-        axlist = [ax for ax in axlist if ax._name != "SlicerAxis"]
-            
-        for ax in axlist:
-            
-            if ax._name in kw:
-                # only include listed indices
-                indexrange = kw[ax._name]
-                if isinstance(indexrange, int):
-                    indexrange = [indexrange]
+        if self.columnar and properties is not None:
+            return self.getColumnarSlice(properties, **kw)
 
-                # are the tupleindices valid?
-                maxtups = len(getattr(ax.Tuples, "Tuple", []))
-                toolarge=[idx for idx in indexrange if idx >= maxtups or idx < 0]
-                if toolarge:
-                    raise ValueError(
-                        "The tuple requested do not exist on axis '%s': %s" % \
-                            (ax._name, indexrange))
-                        
+        indices = self.getAxisIndices(**kw)
+        if [idx for idx in indices if not idx]:
+            # we have requested an empty set from an axis
+            # by calling sth like this: getSlice(Axis2=[])
+            # this renders the whole result empty
+            # it could also because there was an empty set on an axis 
+            # (i.e. "select {} on columns, [measure].members on rows from [some cube]")
+            # anyway, we can simply stop here an return []
+
+            # @@@WHY: shouldn't we rather return a result which dimensionality 
+            # is one less than the amount of axes suggest?
+            # or more generally:
+            #      (#Axes - #EmptyAxes) == dim(result) (not counting SlicerAxis)
+            return []
+
+        cells = [self.getCellByOrdinal(ordinal) for ordinal in self.getOrdinals(indices)]
+        if properties is not None:
+            cells = [self.cellProperties(cell, properties) for cell in cells]
+
+        # the cells are ordered with Axis0 running fastest, so nest them
+        # into lists from the innermost axis outwards
+        for idx in indices[:-1]:
+            n = len(idx)
+            cells = [cells[i:i + n] for i in range(0, len(cells), n)]
+
+        if not indices:
+            # nothing but the SlicerAxis, which has exactly one cell
+            return cells[0]
+        return cells
+
+    def cellProperties(self, cell, properties):
+        """Return the property of cell named properties, or a dict of the
+        properties listed in it."""
+        if isinstance(properties, stringtypes):
+            return getattr(cell, properties, None)
+        return dict((prop, getattr(cell, prop, None)) for prop in aslist(properties))
+
+    def iterSlice(self, properties=None, **kw):
+        """
+        Yield the cells getSlice returns for the same arguments row by row,
+        i.e. a list of the cells along Axis0 for each combination of the
+        tuples on the other axes, AxisN running slowest. Only the cells of
+        one row are held at a time.
+        """
+        indices = self.getAxisIndices(**kw)
+        if [idx for idx in indices if not idx]:
+            return
+        if not indices:
+            indices = [[0]]
+
+        strides = []
+        stride = 1
+        for ax in self.getAxes():
+            strides.append(stride)
+            stride = stride * self.getTupleCount(ax)
+        strides = strides or [1]
+
+        for outer in itertools.product(*reversed(indices[1:])):
+            base = sum(i * stride for (i, stride) in zip(outer, reversed(strides[1:])))
+            cells = [self.getCellByOrdinal(base + i * strides[0]) for i in indices[0]]
+            if properties is not None:
+                cells = [self.cellProperties(cell, properties) for cell in cells]
+            yield cells
+
+    def getOrdinals(self, indices):
+        """Return the cell ordinals of the subcube given by the per axis
+        tuple indices, ordered AxisN slowest ... Axis0 fastest.
+
+        The ordinal of a cell is the sum of its tuple index on each axis
+        multiplied with the axis' stride, i.e. the number of cells spanned
+        by the preceding axes.
+        """
+        strides = []
+        stride = 1
+        for ax in self.getAxes():
+            strides.append(stride)
+            stride = stride * self.getTupleCount(ax)
+
+        if NUMPY and indices:
+            # outer sum of the strided indices by broadcasting
+            grids = numpy.ix_(*reversed(indices))
+            grid = sum(g * stride for (g, stride) in zip(grids, reversed(strides)))
+            return grid.ravel().tolist()
+
+        ordinals = [0]
+        for (idx, stride) in reversed(list(zip(indices, strides))):
+            ordinals = [o + stride * i for o in ordinals for i in idx]
+        return ordinals
+
+
+@zope.interface.implementer(IMDXResult)
+class TupleFormatReaderStreaming(TupleFormatReader):
+    """
+    A TupleFormatReader fed directly from the raw ExecuteResponse body.
+
+    The body is run through lxml's iterparse, axes and cells are converted
+    as soon as their closing tag has been seen and the processed elements
+    are discarded again. The full response tree is never built, only the
+    axis tuples and the cellmap stay in memory.
+    """
+
+    _tuple = ns_name(schema_xmla_mddataset, "Tuple")
+    _axis = ns_name(schema_xmla_mddataset, "Axis")
+    _cell = ns_name(schema_xmla_mddataset, "Cell")
+    _olapinfo = ns_name(schema_xmla_mddataset, "OlapInfo")
+    _fault = ns_name(schema_soap_env, "Fault")
+    _empty = ns_name(schema_xmla_empty, "root")
+
+    def __init__(self, source, columnar=False):
+        """source is either the response body as bytes or a file like object
+        to read it from. empty tells whether the response was the empty
+        root of a command without result."""
+        self.root = Data()
+        self.cols = None
+        self.columnar = columnar
+        self.cellmap = None
+        self.empty = False
+        self.parse(source)
+
+    def mapOrdinalsToCells(self):
+        "Return a dict mapping ordinals to cells"
+        return self.cellmap
+
+    def parse(self, source):
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+
+        axes = []
+        tuples = []
+        tags = (self._tuple, self._axis, self._cell, self._olapinfo, self._fault, self._empty)
+        for (event, elem) in etree.iterparse(source, events=("end",), tag=tags):
+            tag = elem.tag
+            if tag == self._cell:
+                if self.cellmap is None:
+                    # all axes come before the CellData
+                    self.startCellData(axes)
+                cell = fromETree(elem, ns=schema_xmla_mddataset)
+                if self.columnar:
+                    self.cellmap.setCell(int(cell._CellOrdinal), cell)
+                else:
+                    self.cellmap[int(cell._CellOrdinal)] = cell
+            elif tag == self._tuple:
+                tuples.append(fromETree(elem, ns=schema_xmla_mddataset))
+            elif tag == self._axis:
+                # the tuples seen since the last axis are the ones of this axis
+                axes.append(Data(_name=elem.get("name"),
+                                 Tuples=Data(Tuple=tuples)))
+                tuples = []
+            elif tag == self._olapinfo:
+                self.root.OlapInfo = fromETree(elem, ns=schema_xmla_mddataset)
+            elif tag == self._empty:
+                self.empty = True
             else:
-                # include all possible indices
-                indexrange=list(range(len(getattr(ax.Tuples, "Tuple", []))))
-            
-            if not indexrange:
-                # we have requested an empty set from an axis
-                # by calling sth like this: getSlice(Axis2=[])
-                # this renders the whole result empty
-                # it could also because there was an empty set on an axis 
-                # (i.e. "select {} on columns, [measure].members on rows from [some cube]")
-                # anyway, we can simply stop here an return []
-
-                # @@@WHY: shouldn't we rather return a result which dimensionality 
-                # is one less than the amount of axes suggest?
-                # or more generally:
-                #      (#Axes - #EmptyAxes) == dim(result) (not counting SlicerAxis)
-                return []
-                    
-            # first element is a helper to calc the ordinal value from a cell's coord, 
-            # second is the iteration index
-            indexrange = [hyperelemcount * x for x in indexrange]
-            axisrange = [firstindexoffset, []] + indexrange
-            axisranges.append(axisrange)
-            # hyperelemcount for the n-th Axis is the number
-            # of cells in the subcube spanned by Axis(0)..Axis(n-1)
-            hyperelemcount = hyperelemcount*len(ax.Tuples.Tuple)
-
-        # add an entry for the slicer
-        axisranges.append([firstindexoffset, [], 0])
-            
-        lastdimchange = 0
-        while lastdimchange < len(axisranges):
-            # calc ordinal number of cell
-            ordinal = 0
-            for axisrange in axisranges:
-                hyperelemcount=axisrange[axisrange[0]]
-                ordinal = ordinal + hyperelemcount
-            
-            cell = self.getCellByOrdinal(ordinal)
-            if properties is None:
-                axisranges[0][1].append(cell)
+                raise faultException(elem)
+
+            # drop what we have processed along with its already
+            # processed preceding siblings
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+        if self.cellmap is None:
+            self.startCellData(axes)
+
+    def startCellData(self, axes):
+        self.root.Axes = Data(Axis=axes)
+        self.root.CellData = Data()
+        self.cellmap = ColumnarCellStore(self.getCellCount()) if self.columnar else {}
+
+
+def pageCells(page):
+    """Yield (ordinal, cell) for the cells sent for the result page."""
+    if isinstance(page.cellmap, ColumnarCellStore):
+        for ordinal in page.cellmap.mask.nonzero()[0].tolist():
+            yield ordinal, page.cellmap.get(ordinal)
+    else:
+        for item in page.cellmap.items():
+            yield item
+
+
+def mergePages(pages, axis="Axis1", columnar=False):
+    """
+    Return the results pages as one TupleFormatReader. Each page holds the
+    next tuples of axis, the other axes have the same tuples on all pages.
+    The cell ordinals of the pages are renumbered for the merged axis.
+    """
+    first = pages[0]
+    names = [ax._name for ax in first.getAxes()]
+    pos = names.index(axis)
+    # cells spanned by the axes before the merged one
+    inner = 1
+    for ax in first.getAxes()[:pos]:
+        inner = inner * first.getTupleCount(ax)
+
+    tuples = []
+    placed = []
+    for page in pages:
+        pageaxis = page.getAxes()[pos]
+        count = page.getTupleCount(pageaxis)
+        offset = len(tuples)
+        tuples.extend(aslist(getattr(pageaxis.Tuples, "Tuple", [])))
+        for (ordinal, cell) in pageCells(page):
+            (rest, before) = divmod(ordinal, inner)
+            (outer, index) = divmod(rest, count)
+            placed.append((before, offset + index, outer, cell))
+
+    total = len(tuples)
+    cells = []
+    for (before, index, outer, cell) in placed:
+        cell = Data(cell)
+        cell._CellOrdinal = str(before + inner * (index + total * outer))
+        cells.append(cell)
+
+    root = Data(first.root)
+    root.Axes = Data(Axis=[Data(ax, Tuples=Data(Tuple=tuples)) if ax._name == axis else ax
+                           for ax in aslist(first.root.Axes.Axis)])
+    root.CellData = Data(Cell=cells)
+    return TupleFormatReader(root, columnar=columnar)
+
+
+# converters for the types given by xsi:type attributes
+xsitypes = {"xsd:int": int, "xsd:unsignedInt": int, "xsd:long": int,
+            "xsd:double": float, "xsd:float": float}
+
+
+def xsdBoolean(value):
+    return value.strip() in ("true", "1")
+
+
+# converters for the types of the columns declared by a rowset's schema
+xsdtypes = dict([(name, int) for name in ("int", "unsignedInt", "long", "unsignedLong", "short",
+                                          "unsignedShort", "byte", "unsignedByte", "integer")] +
+                [(name, float) for name in ("double", "float", "decimal")] +
+                [("boolean", xsdBoolean)])
+
+# the python types of the values of a column with the given converter
+pythontypes = {int: (int,), float: (float, int), xsdBoolean: (bool,)}
+
+
+class RowsetDecoder(object):
+    """
+    Turns the row elements of a rowset into rows, giving the same rows as
+    fromETree would, but looking up the name and type of each column only
+    once per response instead of once per value. Columns are taken from the
+    xsd schema preceding the rows, columns not declared are learned as they
+    are seen. If typed is true values are converted to the types declared
+    by the schema, otherwise only xsi:type attributes are honored.
+    """
+
+    _row = ns_name(schema_xmla_rowset, "row")
+    _column = ns_name(schema_xmla_rowset, "*")
+    _xsitype = ns_name(schema_instance, "type")
+    _sqlfield = "{urn:schemas-microsoft-com:xml-sql}field"
+
+    def __init__(self, root=None, typed=False):
+        self.typed = typed
+        # tag -> (position, name, converter)
+        self.columns = {}
+        self.fields = []
+        self.types = []
+        # positions of declared columns with values not of the declared type
+        self.irregular = set()
+        if root is not None:
+            self.readSchema(root)
+
+    def readSchema(self, root):
+        """Learn the columns from the schema found below root, if any."""
+        xsd = ns_name(schema_xml, "schema")
+        schema = root if root.tag == xsd else root.find(xsd)
+        if schema is None:
+            return
+        for complexType in schema.iterfind(ns_name(schema_xml, "complexType")):
+            if complexType.get("name") != "row":
+                continue
+            for elem in complexType.iter(ns_name(schema_xml, "element")):
+                name = elem.get("name")
+                if name is None:
+                    continue
+                self.addColumn(ns_name(schema_xmla_rowset, name), elem.get(self._sqlfield, name),
+                               elem.get("type", "").rpartition(":")[2] or None)
+
+    def addColumn(self, tag, field, xsdtype=None):
+        convert = xsdtypes.get(xsdtype) if self.typed else None
+        column = self.columns[tag] = (len(self.fields), QName(tag).localname, convert)
+        self.fields.append(field)
+        self.types.append(xsdtype)
+        return column
+
+    def getFields(self):
+        """Return the field names of the columns, in column order."""
+        return list(self.fields)
+
+    def getTypes(self):
+        """Return the xsd types (without prefix) of the columns, None for
+        columns not declared by the schema and for typed columns some value
+        decoded by decodeTuple did not convert to the declared type for."""
+        return [None if i in self.irregular else t for (i, t) in enumerate(self.types)]
+
+    def value(self, elem, convert):
+        """Return the value of a column element."""
+        if elem.attrib or len(elem):
+            attrib = elem.attrib
+            if len(attrib) == 1 and not len(elem) and attrib.get(self._xsitype) in xsitypes:
+                value = elem.text
+                if value is None or value.isspace():
+                    return None
+                return xsitypes[attrib[self._xsitype]](value)
+            value = fromETree(elem, ns=schema_xmla_rowset)
+            if len(value) != 1:
+                return value
+            value = value.text
+        else:
+            value = elem.text
+        if value is None or value.isspace():
+            return None
+        if convert is not None and isinstance(value, stringtypes):
+            try:
+                value = convert(value)
+            except ValueError:
+                pass
+        return value
+
+    def decodeRow(self, row):
+        """Return row as Data, like fromETree(row, ns=schema_xmla_rowset)."""
+        if row.attrib:
+            return fromETree(row, ns=schema_xmla_rowset)
+        text = row.text
+        result = Data(text=None if text is None or text.isspace() else text)
+        columns = self.columns
+        value = self.value
+        for elem in row.iterchildren(self._column):
+            column = columns.get(elem.tag)
+            if column is None:
+                column = self.addColumn(elem.tag, QName(elem.tag).localname)
+            name = column[1]
+            v = value(elem, column[2])
+            old = result.get(name)
+            if old is None:
+                result[name] = v
+            elif isinstance(old, list):
+                old.append(v)
             else:
-                if isinstance(properties, stringtypes):
-                    d = getattr(cell, properties, 
-                                       None)
-                else:
-                    d = {}
-                    for prop in aslist(properties): 
-                        d[prop] = getattr(cell, prop, 
-                                           None)
-                axisranges[0][1].append(d)
-            
-            # advance to next requested element in slice
-            lastdimchange=0
-            while lastdimchange < len(axisranges):
-                axisrange = axisranges[lastdimchange]
-                if axisrange[0] < len(axisrange)-1:
-                    axisrange[0] = axisrange[0]+1
-                    break
-                else:
-                    axisrange[0] = firstindexoffset
-                    
-                lastdimchange = lastdimchange+1
-                if lastdimchange < len(axisranges):
-                    axisranges[lastdimchange][1].append(axisrange[1])
-                    axisrange[1] = []
-                    
-        # as the last dimension is the sliceraxis it has only one member, 
-        # so we can safely unpack the first element
-        # in that element our resulting multidimensional array has been accumulated
-        return axisranges[lastdimchange-1][1][0]
+                result[name] = [old, v]
+        return result
+
+    def decodeRows(self, root):
+        return [self.decodeRow(row) for row in root.iterchildren(self._row)]
+
+    def decodeTuple(self, row):
+        """Return the values of the declared columns of row as a tuple in
+        column order, _missing for the columns row has no value for."""
+        values = [_missing] * len(self.fields)
+        columns = self.columns
+        value = self.value
+        for elem in row.iterchildren(self._column):
+            column = columns.get(elem.tag)
+            if column is None:
+                continue
+            (i, name, convert) = column
+            v = value(elem, convert)
+            if convert is not None and v is not None and v.__class__ not in pythontypes[convert]:
+                self.irregular.add(i)
+            old = values[i]
+            if old is _missing:
+                values[i] = v
+            else:
+                self.irregular.add(i)
+                values[i] = old + [v] if isinstance(old, list) else [old, v]
+        return tuple(values)
+
+    def decodeTuples(self, root):
+        return [self.decodeTuple(row) for row in root.iterchildren(self._row)]
+
+
+class RowsetReaderStreaming(object):
+    """
+    Incremental parser for the rows of a DiscoverResponse. Feed it the
+    response body chunk by chunk, each call returns the rows completed by
+    that chunk. Processed elements are discarded again.
+    """
+
+    _row = ns_name(schema_xmla_rowset, "row")
+    _fault = ns_name(schema_soap_env, "Fault")
+
+    def __init__(self):
+        self.parser = etree.XMLPullParser(events=("end",), tag=(self._row, self._fault))
+        self.decoder = RowsetDecoder()
+
+    def feed(self, data):
+        self.parser.feed(data)
+        return self.readRows()
+
+    def close(self):
+        self.parser.close()
+        return self.readRows()
+
+    def readRows(self):
+        rows = []
+        for (event, elem) in self.parser.read_events():
+            if elem.tag == self._fault:
+                raise faultException(elem)
+            rows.append(self.decoder.decodeRow(elem))
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return rows
+
+
+def faultException(elem):
+    """Return the XMLAException for a soap Fault element."""
+    detail = elem.find("detail")
+    detail = {} if detail is None else dictify(fromETree(detail, ns=None))
+    return XMLAException(elem.findtext("faultstring"), detail)
+
+
+def numpyColumn(values, xsdtype):
+    """Return the values of a column as numpy array. Integer columns become
+    int64 arrays (float64 if there are empty values), floating point columns
+    float64 arrays with NaN for empty values, complete boolean columns bool
+    arrays. Anything else goes into an object array holding a single
+    instance of each distinct string."""
+    convert = xsdtypes.get(xsdtype)
+    empty = any(v is None or v is _missing for v in values)
+    try:
+        if convert is int and not empty:
+            return numpy.array(values, dtype=numpy.int64)
+        if convert is int or convert is float:
+            return numpy.array([numpy.nan if v is None or v is _missing else v for v in values],
+                               dtype=numpy.float64)
+        if convert is xsdBoolean and not empty:
+            return numpy.array(values, dtype=bool)
+    except (TypeError, ValueError, OverflowError):
+        # some value did not convert to the declared type
+        pass
+    strings = {}
+    return numpy.fromiter((None if v is _missing else strings.setdefault(v, v) if v.__class__ is str else v
+                           for v in values), dtype=object, count=len(values))
+
+
+arrowtypes = {int: "int64", float: "float64", xsdBoolean: "bool_"}
+
+
+def arrowColumn(values, xsdtype):
+    """Return the values of a column as arrow array, typed like the column
+    is declared with nulls for empty values. Other columns are dictionary
+    encoded strings."""
+    values = [None if v is _missing else v for v in values]
+    arrowtype = arrowtypes.get(xsdtypes.get(xsdtype))
+    if arrowtype is not None:
+        try:
+            return pyarrow.array(values, type=getattr(pyarrow, arrowtype)())
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, OverflowError):
+            pass
+    try:
+        strings = pyarrow.array(values, type=pyarrow.string())
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        strings = pyarrow.array([None if v is None else str(v) for v in values], type=pyarrow.string())
+    return strings.dictionary_encode()
 
 
 class TupleFormatReaderTabular(object):
+    """
+    The result of an Execute with Format Tabular. root is the rowset
+    element of the response, rows are kept as tuples of their values in the
+    order of the columns declared by the rowset's schema, converted to the
+    python types matching the declared types.
+    """
 
-    def __init__(self, tupleresult, cols=None):
-        self.root = tupleresult
-        self.colmap = {obj['_name']: obj['_{urn:schemas-microsoft-com:xml-sql}field']
-                       for obj in list(filter(lambda x: x['_name'] == 'row',
-                                              cols['schema']['complexType']))[0]['sequence']['element']}
+    def __init__(self, root):
+        decoder = RowsetDecoder(root, typed=True)
+        self.rows = decoder.decodeTuples(root)
+        self.fields = decoder.getFields()
+        self.types = decoder.getTypes()
 
     def items(self):
-        rows = self.root['row']
-        if not isinstance(rows, list):
-            rows = [rows]
-        for row in rows:
-            item = {}
-            for key, value in row.items():
-                if key in self.colmap:
-                    item[self.colmap[key]] = value
+        fields = self.fields
+        for row in self.rows:
+            yield dict((field, value) for (field, value) in zip(fields, row)
+                       if value is not _missing)
 
-            yield item
+    def getColumn(self, i, start=0, stop=None):
+        return list(map(operator.itemgetter(i), self.rows[start:stop]))
+
+    def to_numpy(self):
+        """Return a dict mapping the fields to numpy arrays of their values,
+        see numpyColumn."""
+        if not NUMPY:
+            raise ImportError("to_numpy needs numpy installed.")
+        return dict((field, numpyColumn(self.getColumn(i), xsdtype))
+                    for (i, (field, xsdtype)) in enumerate(zip(self.fields, self.types)))
+
+    def to_record_batches(self, batch_size=64 * 1024):
+        """Yield the rows as pyarrow RecordBatches of at most batch_size rows,
+        converting one batch at a time. See arrowColumn for the column types.
+        All rows have been decoded already, for results larger than memory
+        execute with streaming=True (see TupleFormatReaderTabularStreaming)."""
+        if not ARROW:
+            raise ImportError("to_record_batches needs pyarrow installed.")
+        for start in range(0, len(self.rows), batch_size):
+            yield recordBatch(self.rows[start:start + batch_size], self.fields, self.types)
+
+
+class TupleFormatReaderTabularStreaming(object):
+    """
+    The result of an Execute with Format Tabular, decoded from the raw
+    response while its rows are asked for. Only the rows parsed but not
+    handed out yet are kept, so any number of rows can be consumed in
+    bounded memory, but only once. fields and types (as declared by the
+    schema of the rowset) are known from the start. The response is closed
+    when all rows have been read, or by close.
+    """
+
+    _row = ns_name(schema_xmla_rowset, "row")
+    _schema = ns_name(schema_xml, "schema")
+    _fault = ns_name(schema_soap_env, "Fault")
+
+    def __init__(self, source, close=None, chunk_size=64 * 1024):
+        """source is either the response body as bytes or a file like object
+        to read it from, close is called when done with it."""
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        self.source = source
+        self.closeSource = close
+        self.chunk_size = chunk_size
+        self.parser = etree.XMLPullParser(events=("end",), tag=(self._row, self._schema, self._fault))
+        self.decoder = RowsetDecoder(typed=True)
+        self.pending = deque()
+        self.done = False
+        self.schema = False
+        # the schema precedes the rows
+        while not self.schema and not self.pending and self.read():
+            pass
+        self.fields = self.decoder.getFields()
+        self.types = list(self.decoder.types)
+
+    def read(self):
+        """Parse the next chunk of the response, False if there is none."""
+        if self.done:
+            return False
+        try:
+            data = self.source.read(self.chunk_size)
+            if data:
+                self.parser.feed(data)
+            else:
+                self.done = True
+                self.parser.close()
+                self.close()
+            for (event, elem) in self.parser.read_events():
+                if elem.tag == self._row:
+                    self.pending.append(self.decoder.decodeTuple(elem))
+                elif elem.tag == self._schema:
+                    self.decoder.readSchema(elem)
+                    self.schema = True
+                else:
+                    raise faultException(elem)
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        except BaseException:
+            self.done = True
+            self.close()
+            raise
+        return True
+
+    def close(self):
+        if self.closeSource is not None:
+            close, self.closeSource = self.closeSource, None
+            close()
+
+    def iterTuples(self):
+        """Yield the rows as tuples, see TupleFormatReaderTabular."""
+        while True:
+            while self.pending:
+                yield self.pending.popleft()
+            if not self.read():
+                return
+
+    def items(self):
+        fields = self.fields
+        for row in self.iterTuples():
+            yield dict((field, value) for (field, value) in zip(fields, row)
+                       if value is not _missing)
+
+    def to_record_batches(self, batch_size=64 * 1024):
+        """Yield the rows as pyarrow RecordBatches of at most batch_size rows,
+        decoding the response one batch at a time. See arrowColumn for the
+        column types, a column with values not matching its declared type
+        becomes a string column in the batches holding them."""
+        if not ARROW:
+            raise ImportError("to_record_batches needs pyarrow installed.")
+        batch = []
+        for row in self.iterTuples():
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield recordBatch(batch, self.fields, self.types)
+                batch = []
+        if batch:
+            yield recordBatch(batch, self.fields, self.types)
+
+
+def recordBatch(rows, fields, types):
+    """Return the rows (tuples of values) as pyarrow RecordBatch."""
+    columns = [arrowColumn(list(map(operator.itemgetter(i), rows)), xsdtype)
+               for (i, xsdtype) in enumerate(types)]
+    return pyarrow.RecordBatch.from_arrays(columns, names=fields)
@@ -0,0 +1,296 @@
+'''
+A local index of all members of a hierarchy, so navigating the member tree
+doesn't take a request per step:
+
+    index = cube.getHierarchy("[Store]").getIndex()
+    index.getChildren("[Store].[USA]")
+    index.getDescendants("[Store].[USA]", depth=2)
+    # after members below [Store].[USA] changed on the server
+    cube.getHierarchy("[Store]").refreshIndex("[Store].[USA]")
+'''
+from array import array
+from bisect import bisect_left
+
+from .utils import stringtypes
+
+
+class HierarchyIndex(object):
+    """
+    The members of a hierarchy in hierarchy order, i.e. each member is
+    followed by its descendants and siblings keep the order the server
+    returned them in. Positions in that order are kept in arrays:
+
+    parents: position of the parent, -1 for root members
+    childoffsets, children: the children of position i are at
+        children[childoffsets[i]:childoffsets[i + 1]]
+    ends: the descendants of position i are at i + 1 ... ends[i] - 1
+    depths: distance to the root member
+    levels, leveloffsets, levelmembers: LEVEL_NUMBER of each position, the
+        positions of level n are at levelmembers[leveloffsets[n]:leveloffsets[n + 1]]
+
+    Members may be given as XMLAMember instances or unique names.
+    """
+
+    def __init__(self, members):
+        self.build(members)
+
+    def layout(self, members):
+        """Return members in hierarchy order along with the position of the
+        parent of each, -1 if the parent isn't among members, and their
+        distance to those roots."""
+        byname = {}
+        for m in members:
+            byname[m.getUniqueName()] = m
+        parentof = {}
+        kids = {}
+        roots = []
+        for (name, m) in byname.items():
+            parent = m.getParentName()
+            if parent in byname:
+                parentof[name] = parent
+                kids.setdefault(parent, []).append(name)
+            else:
+                roots.append(name)
+
+        positions = {}
+        parents = []
+        depths = []
+        stack = roots[::-1]
+        while stack:
+            name = stack.pop()
+            positions[name] = len(parents)
+            parent = positions[parentof[name]] if name in parentof else -1
+            parents.append(parent)
+            depths.append(depths[parent] + 1 if parent >= 0 else 0)
+            if name in kids:
+                stack.extend(kids[name][::-1])
+        return [byname[name] for name in positions], parents, depths
+
+    def build(self, members):
+        (self.members, parents, depths) = self.layout(members)
+        self.positions = dict((m.getUniqueName(), pos) for (pos, m) in enumerate(self.members))
+        self.parents = array("l", parents)
+        self.depths = array("l", depths)
+        size = len(self.members)
+        self.ends = self.subtreeEnds(self.parents)
+        (self.childoffsets, self.children) = self.childArrays(self.parents)
+
+        self.levels = array("l", [int(m.LEVEL_NUMBER) for m in self.members])
+        nlevels = max(self.levels) + 1 if size else 0
+        self.leveloffsets = self.offsets(self.levels, nlevels)
+        self.levelmembers = array("l", sorted(range(size), key=self.levels.__getitem__))
+        self.levelnumbers = {}
+        for pos in self.leveloffsets[:-1]:
+            if pos < size:
+                pos = self.levelmembers[pos]
+                self.levelnumbers[self.members[pos].LEVEL_UNIQUE_NAME] = self.levels[pos]
+
+    def subtreeEnds(self, parents):
+        """Return the position after the last descendant of each position."""
+        ends = array("l", range(1, len(parents) + 1))
+        for pos in range(len(parents) - 1, 0, -1):
+            parent = parents[pos]
+            if parent >= 0 and ends[pos] > ends[parent]:
+                ends[parent] = ends[pos]
+        return ends
+
+    def childArrays(self, parents):
+        """Return childoffsets and children for parents."""
+        childoffsets = self.offsets(parents, len(parents))
+        children = array("l", [0] * childoffsets[-1])
+        fill = array("l", childoffsets)
+        for (pos, parent) in enumerate(parents):
+            if parent >= 0:
+                children[fill[parent]] = pos
+                fill[parent] += 1
+        return childoffsets, children
+
+    def offsets(self, keys, count):
+        """Return the start of each key in a list of positions sorted by
+        keys, keys below 0 are left out."""
+        counts = array("l", [0] * (count + 1))
+        for key in keys:
+            if key >= 0:
+                counts[key + 1] += 1
+        for i in range(count):
+            counts[i + 1] += counts[i]
+        return counts
+
+    def position(self, member):
+        name = member if isinstance(member, stringtypes) else member.getUniqueName()
+        return self.positions[name]
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member):
+        name = member if isinstance(member, stringtypes) else member.getUniqueName()
+        return name in self.positions
+
+    def get(self, unique_name):
+        return self.members[self.positions[unique_name]]
+
+    def getMembers(self):
+        """Return all members in hierarchy order."""
+        return list(self.members)
+
+    def getOrdinal(self, member):
+        """Return the position of member in hierarchy order."""
+        return self.position(member)
+
+    def getRoots(self):
+        return [m for (m, parent) in zip(self.members, self.parents) if parent < 0]
+
+    def getParent(self, member):
+        """Return the parent of member or None for a root member."""
+        parent = self.parents[self.position(member)]
+        return self.members[parent] if parent >= 0 else None
+
+    def getChildren(self, member):
+        pos = self.position(member)
+        return [self.members[kid] for kid in
+                self.children[self.childoffsets[pos]:self.childoffsets[pos + 1]]]
+
+    def hasChildren(self, member):
+        pos = self.position(member)
+        return self.childoffsets[pos + 1] > self.childoffsets[pos]
+
+    def getSiblings(self, member):
+        """Return the siblings of member (member not included)."""
+        pos = self.position(member)
+        parent = self.parents[pos]
+        if parent >= 0:
+            kids = self.children[self.childoffsets[parent]:self.childoffsets[parent + 1]]
+        else:
+            kids = [i for (i, p) in enumerate(self.parents) if p < 0]
+        return [self.members[kid] for kid in kids if kid != pos]
+
+    def hasSiblings(self, member):
+        pos = self.position(member)
+        parent = self.parents[pos]
+        if parent >= 0:
+            return self.childoffsets[parent + 1] - self.childoffsets[parent] > 1
+        return len(self.getSiblings(member)) > 0
+
+    def getAncestors(self, member):
+        """Return the ancestors of member, starting with the parent."""
+        result = []
+        parent = self.parents[self.position(member)]
+        while parent >= 0:
+            result.append(self.members[parent])
+            parent = self.parents[parent]
+        return result
+
+    def getDescendants(self, member, depth=None):
+        """Return the members below member down to depth levels, or the whole
+        subtree if depth is None, in hierarchy order (member not included)."""
+        pos = self.position(member)
+        if depth is None:
+            return self.members[pos + 1:self.ends[pos]]
+        maxdepth = self.depths[pos] + depth
+        return [self.members[i] for i in range(pos + 1, self.ends[pos])
+                if self.depths[i] <= maxdepth]
+
+    def getLevelMembers(self, level):
+        """Return the members on level, given as LEVEL_NUMBER or level
+        unique name, in hierarchy order."""
+        if isinstance(level, stringtypes):
+            level = self.levelnumbers.get(level, -1)
+        if level < 0 or level + 1 >= len(self.leveloffsets):
+            return []
+        return [self.members[i] for i in
+                self.levelmembers[self.leveloffsets[level]:self.leveloffsets[level + 1]]]
+
+    def replaceSubtree(self, member, members):
+        """Replace member and its descendants by members, i.e. the member and
+        its descendants as returned by the server now. members is empty if
+        the member is gone, if member isn't indexed yet members are added
+        after the descendants of their parent.
+
+        Only the entries of the replaced positions are rebuilt, the ones
+        after them are moved."""
+        (sub, subparents, subdepths) = self.layout(members)
+        name = member if isinstance(member, stringtypes) else member.getUniqueName()
+        if name in self.positions:
+            start = self.positions[name]
+            stop = self.ends[start]
+            parent = self.parents[start]
+        elif sub:
+            parent = self.positions.get(sub[0].getParentName(), -1)
+            start = stop = self.ends[parent] if parent >= 0 else len(self.members)
+        else:
+            return
+        count = len(sub)
+        delta = count - (stop - start)
+
+        def moved(positions):
+            return array("l", [pos + delta if pos >= stop else pos for pos in positions])
+
+        def placed(positions):
+            return array("l", [start + pos for pos in positions])
+
+        for m in self.members[start:stop]:
+            del self.positions[m.getUniqueName()]
+        self.members[start:stop] = sub
+        if delta:
+            for pos in range(start + count, len(self.members)):
+                self.positions[self.members[pos].getUniqueName()] = pos
+        for (pos, m) in enumerate(sub):
+            self.positions[m.getUniqueName()] = start + pos
+
+        depth = self.depths[parent] + 1 if parent >= 0 else 0
+        self.depths = self.depths[:start] + array("l", [depth + d for d in subdepths]) + self.depths[stop:]
+        self.parents = (moved(self.parents[:start])
+                        + array("l", [start + p if p >= 0 else parent for p in subparents])
+                        + moved(self.parents[stop:]))
+
+        ends = self.ends[:start] + placed(self.subtreeEnds(subparents)) + moved(self.ends[stop:])
+        ancestor = parent
+        while ancestor >= 0:
+            ends[ancestor] += delta
+            ancestor = self.parents[ancestor]
+        self.ends = ends
+
+        # the children of the parent are sorted by position, the new roots
+        # of the subtree take the place of the old one
+        (subchildoffsets, subchildren) = self.childArrays(subparents)
+        offsets = self.childoffsets
+        head = self.children[:offsets[start]]
+        added = 0
+        if parent >= 0:
+            (a, b) = (offsets[parent], offsets[parent + 1])
+            kids = [kid for kid in head[a:b] if not start <= kid < stop]
+            i = bisect_left(kids, start)
+            roots = [start + pos for (pos, p) in enumerate(subparents) if p < 0]
+            region = moved(kids[:i]) + array("l", roots) + moved(kids[i:])
+            added = len(region) - (b - a)
+            head = moved(head[:a]) + region + moved(head[b:])
+        else:
+            head = moved(head)
+        self.children = head + placed(subchildren) + moved(self.children[offsets[stop]:])
+        base = offsets[start] + added
+        self.childoffsets = (offsets[:parent + 1]
+                             + array("l", [offset + added for offset in offsets[parent + 1:start]])
+                             + array("l", [base + offset for offset in subchildoffsets])
+                             + array("l", [offset - offsets[stop] + base + subchildoffsets[-1]
+                                           for offset in offsets[stop + 1:]]))
+
+        sublevels = [int(m.LEVEL_NUMBER) for m in sub]
+        self.levels = self.levels[:start] + array("l", sublevels) + self.levels[stop:]
+        nlevels = max([len(self.leveloffsets) - 1] + [level + 1 for level in sublevels])
+        levelmembers = array("l")
+        leveloffsets = array("l", [0])
+        for level in range(nlevels):
+            if level + 1 < len(self.leveloffsets):
+                region = self.levelmembers[self.leveloffsets[level]:self.leveloffsets[level + 1]]
+            else:
+                region = array("l")
+            (a, b) = (bisect_left(region, start), bisect_left(region, stop))
+            levelmembers += (region[:a]
+                             + placed(pos for (pos, l) in enumerate(sublevels) if l == level)
+                             + moved(region[b:]))
+            leveloffsets.append(len(levelmembers))
+        self.levelmembers = levelmembers
+        self.leveloffsets = leveloffsets
+        for m in sub:
+            self.levelnumbers.setdefault(m.LEVEL_UNIQUE_NAME, int(m.LEVEL_NUMBER))
@@ -55,6 +55,102 @@ containing a certicate bundle"""),
         required=False
     )
 
+    streaming = zope.schema.Bool(
+        title=u("streaming"),
+        description=u("""Parse multidimensional Execute results incrementally from the
+raw response instead of building the complete response tree first"""),
+        required=False,
+        default=False
+    )
+
+    columnar = zope.schema.Bool(
+        title=u("columnar"),
+        description=u("""Keep the cells of multidimensional results in numpy arrays,
+getSlice then returns numpy arrays for the requested properties"""),
+        required=False,
+        default=False
+    )
+
+    pool_maxsize = zope.schema.Int(
+        title=u("pool_maxsize"),
+        description=u("""Maximum number of http connections kept open to the XMLA server.
+pool_connections (number of hosts to keep pools for) and pool_block (wait for a free
+connection instead of opening an additional one) can be passed as well"""),
+        required=False
+    )
+
+    keepalive = zope.schema.Bool(
+        title=u("keepalive"),
+        description=u("""Reuse http connections between requests"""),
+        required=False,
+        default=True
+    )
+
+    connect_timeout = zope.schema.Float(
+        title=u("connect_timeout"),
+        description=u("""Seconds to wait for a connection to the XMLA server"""),
+        required=False
+    )
+
+    read_timeout = zope.schema.Float(
+        title=u("read_timeout"),
+        description=u("""Seconds to wait for the XMLA server to answer"""),
+        required=False
+    )
+
+    retries = zope.schema.Int(
+        title=u("retries"),
+        description=u("""How often to retry a Discover failing with a connection error or
+timeout. The delay between the attempts starts at retry_backoff seconds and doubles
+with each attempt"""),
+        required=False,
+        default=0
+    )
+
+    discover_cache = zope.schema.TextLine(
+        title=u("discover_cache"),
+        description=u("""Cache for Discover rowsets, an instance of one of the caches in
+olap.xmla.cache or True for an in memory cache"""),
+        required=False
+    )
+
+    cache_identity = zope.schema.TextLine(
+        title=u("cache_identity"),
+        description=u("""Who the cached Discover and Execute responses belong to, defaults to
+the user name of auth"""),
+        required=False
+    )
+
+    result_cache = zope.schema.TextLine(
+        title=u("result_cache"),
+        description=u("""An olap.xmla.cache.ResultCache keeping the results of MDX statements"""),
+        required=False
+    )
+
+    soap_templates = zope.schema.Bool(
+        title=u("soap_templates"),
+        description=u("""Fill the envelopes of Discover and Execute into templates instead of
+having zeep build each of them. Implies raw_transport"""),
+        required=False,
+        default=False
+    )
+
+    raw_transport = zope.schema.Bool(
+        title=u("raw_transport"),
+        description=u("""Post Discover and Execute requests and parse their responses without
+going through zeep. Streamed results are parsed while they are received"""),
+        required=False,
+        default=False
+    )
+
+    wsdl_cache = zope.schema.Bool(
+        title=u("wsdl_cache"),
+        description=u("""Parse the wsdl once per process and share it with all connections
+made to the same wsdl url"""),
+        required=False,
+        default=True
+    )
+
     def getSchemaElements(schemaElementType, unique_name,
                           aslist=False, more_restrictions=None,
                           more_properties=None,
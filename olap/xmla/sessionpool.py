@@ -0,0 +1,208 @@
+'''
+A pool of XMLA sessions opened in advance and leased to the threads needing
+one, e.g. for session scoped calculated members:
+
+    from olap.xmla.sessionpool import SessionPool
+
+    pool = SessionPool(c, size=4)
+    with pool.lease():
+        # commands without result return None
+        c.Execute("CREATE MEMBER [Sales].[Measures].[Profit] AS ...", Catalog="FoodMart")
+        c.Execute("SELECT [Measures].[Profit] ON COLUMNS FROM [Sales]", Catalog="FoodMart")
+    pool.close()
+'''
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .interfaces import XMLAException
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool(object):
+    """
+    Keeps size sessions open on the server of the (synchronous) connection
+    conn. A leased session is active on conn for the leasing thread only,
+    other threads keep working in their own lease or without a session.
+
+    Sessions older than max_age seconds or idle for more than max_idle
+    seconds are replaced by new ones (None to keep them), sessions idle for
+    more than check_after seconds are checked to still exist on the server
+    before they are leased again.
+    """
+
+    def __init__(self, conn, size=4, max_idle=600, max_age=None, check_after=60):
+        self.conn = conn
+        self.size = size
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.check_after = check_after
+        self.lock = threading.Condition()
+        # sessions not leased, the most recently released last
+        self.idle = deque()
+        self.leased = set()
+        # sessions open or being opened
+        self.count = 0
+        self.closed = False
+        self.opened = 0
+        self.discarded = 0
+        self.waits = 0
+        try:
+            for i in range(size):
+                self.idle.append(self.openSession())
+                self.count += 1
+        except BaseException:
+            # don't leave the sessions opened so far on the server
+            self.close()
+            raise
+
+    def openSession(self):
+        session = self.conn.openSession()
+        with self.lock:
+            self.opened += 1
+        return session
+
+    def closeSession(self, session):
+        with self.lock:
+            self.discarded += 1
+        try:
+            self.conn.closeSession(session.sessionId)
+        except Exception as e:
+            logger.warning("closing xmla session %s failed (%s)", session.sessionId, e)
+
+    def expired(self, session, now):
+        return (self.max_age is not None and now - session.created > self.max_age) or \
+               (self.max_idle is not None and now - session.used > self.max_idle)
+
+    def check(self, session):
+        """Return whether session is still known to the server."""
+        token = self.conn.activateSession(session)
+        try:
+            self.conn.Discover("DISCOVER_DATASOURCES")
+            return True
+        except XMLAException:
+            return False
+        finally:
+            self.conn.deactivateSession(token)
+
+    def acquire(self, timeout=None):
+        """Return an idle session, waiting at most timeout seconds for one
+        to be released. Pass it to release when done."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise RuntimeError("the session pool is closed")
+                if self.idle:
+                    session = self.idle.pop()
+                    break
+                if self.count < self.size:
+                    # a session has been discarded, open a new one instead
+                    self.count += 1
+                    session = None
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("no xmla session released within %ss" % timeout)
+                self.waits += 1
+                self.lock.wait(remaining)
+
+        try:
+            now = time.time()
+            if session is not None and (self.expired(session, now) or
+                                        (self.check_after is not None and
+                                         now - session.used > self.check_after and
+                                         not self.check(session))):
+                self.closeSession(session)
+                session = None
+            if session is None:
+                session = self.openSession()
+        except Exception:
+            with self.lock:
+                self.count -= 1
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.leased.add(session)
+        return session
+
+    def release(self, session, discard=False):
+        """Hand a session back to the pool, discard closes it instead, e.g.
+        if its session scoped objects are of no use to the next lease."""
+        with self.lock:
+            self.leased.discard(session)
+            discard = discard or self.closed
+            if discard:
+                self.count -= 1
+            else:
+                session.used = time.time()
+                self.idle.append(session)
+            self.lock.notify()
+        if discard:
+            self.closeSession(session)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """Context manager acquiring a session and making it the active
+        session of conn for the calling thread while in the block."""
+        session = self.acquire(timeout)
+        token = self.conn.activateSession(session)
+        try:
+            yield session
+        finally:
+            self.conn.deactivateSession(token)
+            self.release(session)
+
+    def recycle(self):
+        """Replace the expired idle sessions and open new ones for those
+        discarded, meant to be called periodically by pools kept for a
+        long time."""
+        now = time.time()
+        with self.lock:
+            expired = [session for session in self.idle if self.expired(session, now)]
+            for session in expired:
+                self.idle.remove(session)
+            self.count -= len(expired)
+            missing = 0 if self.closed else self.size - self.count
+            self.count += missing
+        for session in expired:
+            self.closeSession(session)
+        for i in range(missing):
+            try:
+                session = self.openSession()
+            except Exception:
+                with self.lock:
+                    self.count -= missing - i
+                raise
+            with self.lock:
+                self.idle.appendleft(session)
+                self.lock.notify()
+
+    def close(self):
+        """Close the idle sessions, leased ones are closed on release."""
+        with self.lock:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            self.count -= len(idle)
+            self.lock.notify_all()
+        for session in idle:
+            self.closeSession(session)
+
+    def getStats(self):
+        with self.lock:
+            return {"size": self.size,
+                    "idle": len(self.idle),
+                    "leased": len(self.leased),
+                    "opened": self.opened,
+                    "discarded": self.discarded,
+                    "waits": self.waits}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,3 +1,7 @@
+import importlib.util
+import operator
+import sys
+
 import six
 from lxml import etree
 from lxml.etree import QName
@@ -7,6 +11,13 @@ _UnmarshallableType = (type(None), six.string_types, six.integer_types, float, b
 u = six.u
 
 schema_instance = "http://www.w3.org/2001/XMLSchema-instance"
+schema_xmla = "urn:schemas-microsoft-com:xml-analysis"
+schema_xmla_rowset = "urn:schemas-microsoft-com:xml-analysis:rowset"
+schema_xmla_mddataset = "urn:schemas-microsoft-com:xml-analysis:mddataset"
+# the root returned by commands without a result, e.g. CREATE MEMBER
+schema_xmla_empty = "urn:schemas-microsoft-com:xml-analysis:empty"
+schema_soap_env = "http://schemas.xmlsoap.org/soap/envelope/"
+schema_xml = "http://www.w3.org/2001/XMLSchema"
 
 
 class Data(dict):
@@ -23,6 +34,67 @@ class Data(dict):
         del self[name]
 
 
+class LazyModule(object):
+    """
+    Stands in for the module name, which is imported when one of its
+    attributes is first asked for. Keeps optional, slow to import
+    dependencies like numpy out of the import of olap.xmla.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_lazyname"] = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__dict__["_lazyname"])
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def installed(name):
+    """Return whether the module name can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# marks a column a row has no value for
+_missing = object()
+
+
+def compactRows(rows):
+    """Return the names of all columns found in rows (dicts) and the rows as
+    tuples of their values in column order. Columns a row has no value for
+    are set to _missing. Strings of columns repeating their values, like
+    CUBE_NAME or LEVEL_UNIQUE_NAME, are interned."""
+    columns = tuple(rows[0]) if rows else ()
+    values = None
+    if len(columns) > 1 and all(len(row) == len(columns) for row in rows):
+        # usually all rows have the same columns
+        try:
+            values = list(map(operator.itemgetter(*columns), rows))
+        except KeyError:
+            pass
+    if values is None:
+        names = {}
+        for row in rows:
+            names.update(dict.fromkeys(row))
+        columns = tuple(names)
+        values = [tuple([row.get(name, _missing) for name in columns]) for row in rows]
+
+    if len(values) > 1:
+        cols = list(zip(*values))
+        for (i, col) in enumerate(cols):
+            sample = col[:16]
+            if all(v.__class__ is str for v in sample) and len(set(sample)) < len(sample):
+                try:
+                    cols[i] = list(map(sys.intern, col))
+                except TypeError:
+                    pass
+        values = list(zip(*cols))
+    return tuple(map(sys.intern, columns)), values
+
+
 def aslist(something):
     """If something is not a list already make it one, otherwise simply return something"""
     return something if isinstance(something, list) else [something]
@@ -45,6 +117,15 @@ def dictify(r, keep_none_text=False):
     return r
 
 
+def datafy(r):
+    """Turn the dicts in r, e.g. as made by dictify, back into Data."""
+    if isinstance(r, list):
+        return [datafy(x) for x in r]
+    if isinstance(r, dict):
+        return Data((k, datafy(v)) for (k, v) in r.items())
+    return r
+
+
 def schemaNameToMethodName(schemaName):
     """
     Convert a schema name like DISCOVER_SCHEMA_ROWSETS into a method name like getSchemaRowsets.
@@ -1,13 +1,17 @@
+import re
+from collections import deque
+
 import zope.interface
-from .interfaces import IXMLASource, schemaElementTypes, SchemaElementNotFound
-from .connection import XMLAConnection
+from .interfaces import IXMLASource, schemaElementTypes, SchemaElementNotFound, XMLAException
+from .connection import XMLAConnection, rowsetmethods, preloadWsdl
+from .formatreader import mergePages
+from .hierarchyindex import HierarchyIndex
 import olap.interfaces as ooi
-from .utils import u
+from .utils import u, aslist, stringtypes, compactRows, Data, _missing
 
-from pkg_resources import ResourceManager
+from importlib.resources import files
 
-rm = ResourceManager()
-defaultwsdl = "file://" + rm.resource_filename(__name__, "vs.wsdl")
+defaultwsdl = "file://" + str(files(__package__).joinpath("vs.wsdl"))
 
 
 class TREE_OP(object):
@@ -19,18 +23,111 @@ class TREE_OP(object):
     ANCESTORS = 0x20
 
 
+# intrinsic member properties asked for when members are fetched by MDX
+MEMBER_PROPERTIES = ["PARENT_UNIQUE_NAME", "PARENT_COUNT", "CHILDREN_CARDINALITY",
+                     "MEMBER_NAME", "MEMBER_TYPE"]
+
+
+def bracket(name):
+    """Quote name as a MDX identifier."""
+    return "[" + name.replace("]", "]]") + "]"
+
+
+def uniqueNames(members):
+    """Return the unique names of members, which may be given as
+    XMLAMember instances or unique names."""
+    return [m if isinstance(m, stringtypes) else m.getUniqueName() for m in members]
+
+
+_firstname = re.compile(r"\[(?:[^\]]|\]\])*\]")
+
+
+def hierarchyGroups(members):
+    """Return the unique names of members in lists of members of the same
+    hierarchy, as far as known: names given as strings are grouped by
+    their first part, the dimension or hierarchy."""
+    groups = {}
+    for m in members:
+        if isinstance(m, stringtypes):
+            first = _firstname.match(m)
+            key = first.group() if first else m
+        else:
+            key = getattr(m, "HIERARCHY_UNIQUE_NAME", None) or m.getUniqueName()
+        groups.setdefault(key, []).append(m if isinstance(m, stringtypes) else m.getUniqueName())
+    return list(groups.values())
+
+
+def groupByParent(members):
+    """Return a dict mapping parent unique names to the list of their
+    children among members, keeping the order of members."""
+    grouped = {}
+    for m in members:
+        grouped.setdefault(m.getParentName(), []).append(m)
+    return grouped
+
+
 @zope.interface.implementer(ooi.IProvider)
 class XMLAProvider(object):
 
     def connect(self, url=defaultwsdl, location=None, sslverify=True, **kwargs):
         return XMLASource(url, location, sslverify, **kwargs)
 
+    def preload(self, url=defaultwsdl, freeze=False):
+        """Parse the wsdl before forking workers, which then connect without
+        parsing it again, see connection.preloadWsdl."""
+        preloadWsdl(url, freeze)
+
+
+# (element class, columns) -> subclass of the element class reading the columns
+_recordclasses = {}
+
+
+def columnGetter(index, name):
+    def get(self):
+        value = self._values[index]
+        if value is _missing:
+            raise AttributeError(name)
+        return value
+
+    return get
+
+
+def recordClass(clazz, columns):
+    """Return the subclass of clazz whose instances keep the values of
+    columns in a tuple, each column read through a property."""
+    key = (clazz, columns)
+    rc = _recordclasses.get(key)
+    if rc is None:
+        attrs = {"__slots__": (), "__module__": clazz.__module__,
+                 "_columns": columns, "_elementclass": clazz}
+        for (i, name) in enumerate(columns):
+            if not hasattr(clazz, name):
+                attrs[name] = property(columnGetter(i, name))
+        rc = _recordclasses[key] = type(clazz.__name__, (clazz,), attrs)
+    return rc
+
 
 @zope.interface.implementer(ooi.IOLAPSchemaElement)
 class XMLAClass(object):
+    """
+    Instances keep the values of their row in a tuple. The columns are kept
+    with the class, objectfactory creates one subclass per element class and
+    set of columns, shared by all elements of a rowset.
+    """
+    __slots__ = ("_values", "_conn", "unique_name_property", "schemaElementName")
+    _columns = ()
+    _elementclass = None
+
+    # ELEMENT_CLASS of schemaElementTypes -> class, filled in below
+    elementclasses = {}
 
     def __init__(self, unique_name_property, properties, schemaElementName, conn):
-        self._properties = properties
+        if isinstance(properties, dict):
+            columns, rows = compactRows([properties])
+            if columns:
+                self.__class__ = recordClass(self.getElementClass(), columns)
+            properties = rows[0]
+        self._values = properties
         self._conn = conn
         self.unique_name_property = unique_name_property
         self.schemaElementName = schemaElementName
@@ -38,24 +135,14 @@ class XMLAClass(object):
     def __str__(self):
         return self.__class__.__name__ + ":" + str(self.getElementProperties())
 
-    def __repr__(self):
-        un = self._properties.get(self.unique_name_property, "???")
-        return self.__class__.__name__ + "<" + un + ">"
-
     __repr__ = __str__
 
+    def getElementClass(self):
+        return self._elementclass or self.__class__
+
     def getElementProperties(self):
-        return self._properties
-
-    def __getattr__(self, name):
-        # print("__getattr__", name)
-        # if name == "_properties":
-        #    return object.__getattribute__(self, name)
-        # print(self._properties)
-        if name in self._properties:
-            return self._properties[name]
-        # print(name, "not in self._properties" )
-        return object.__getattr__(self, name)
+        return Data((name, value) for (name, value) in zip(self._columns, self._values)
+                    if value is not _missing)
 
     def getUniqueName(self):
         if hasattr(self, self.unique_name_property):
@@ -63,13 +150,51 @@ class XMLAClass(object):
         return None
 
     def objectfactory(self, clazzname, unp, schemaElementName, props):
-        clazz = globals()[clazzname]
-        return [clazz(unp, prop, schemaElementName, self._conn) for prop in props]
+        columns, rows = compactRows(props)
+        clazz = recordClass(self.elementclasses[clazzname], columns)
+        conn = self._conn
+        return [clazz(unp, row, schemaElementName, conn) for row in rows]
 
     def getSchemaElements(self, schemaElementName, unique_name,
                           aslist=False, more_restrictions=None,
                           more_properties=None,
                           generate_instance=True):
+        func, r, properties = self.getSchemaRequest(schemaElementName, unique_name,
+                                                    more_restrictions, more_properties)
+        props = func(r, properties)
+        return self.getSchemaResult(schemaElementName, props, r, properties,
+                                    aslist, generate_instance)
+
+    def iterSchemaElements(self, schemaElementName, unique_name=None,
+                           more_restrictions=None, more_properties=None,
+                           generate_instance=True, batch_size=1000):
+        """Like getSchemaElements with aslist=True, but yield the elements
+        while the response is read instead of returning a list. The elements
+        are created batch_size rows at a time."""
+        func, r, properties = self.getSchemaRequest(schemaElementName, unique_name,
+                                                    more_restrictions, more_properties)
+        what = rowsetmethods[schemaElementTypes[schemaElementName]["XMLA_FUNC"]]
+        batch = []
+        for row in self._conn.iterDiscover(what, r, properties):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                for element in self.getSchemaBatch(schemaElementName, batch, generate_instance):
+                    yield element
+                batch = []
+        for element in self.getSchemaBatch(schemaElementName, batch, generate_instance):
+            yield element
+
+    def getSchemaBatch(self, schemaElementName, rows, generate_instance=True):
+        if not generate_instance or not rows:
+            return rows
+        et = schemaElementTypes[schemaElementName]
+        return self.objectfactory(et["ELEMENT_CLASS"], et["PROPERTY_NAME"],
+                                  schemaElementName, rows)
+
+    def getSchemaRequest(self, schemaElementName, unique_name,
+                         more_restrictions=None, more_properties=None):
+        """Return the Discover function to call for the schema element
+        along with the restrictions and properties to call it with."""
         types = schemaElementTypes
         et = types[schemaElementName]
 
@@ -112,7 +237,13 @@ class XMLAClass(object):
             properties["Catalog"] = r.pop(cat_rn)
 
         func = getattr(self._conn, et["XMLA_FUNC"])
-        props = func(r, properties)
+        return func, r, properties
+
+    def getSchemaResult(self, schemaElementName, props, r, properties,
+                        aslist=False, generate_instance=True):
+        """Turn the rows returned by Discover into the result of
+        getSchemaElements."""
+        et = schemaElementTypes[schemaElementName]
 
         if props is None or len(props) == 0:
             raise SchemaElementNotFound(r, properties)
@@ -133,6 +264,100 @@ class XMLAClass(object):
         return self._conn.Execute(mdx_stmt, Catalog=self.CATALOG_NAME)
 
 
+class XMLAMemberQueries(object):
+    """
+    Navigation of many members at once. Each call sends one MDX statement
+    per hierarchy against the cube instead of one Discover per member, the
+    members returned carry the properties in MEMBER_PROPERTIES besides
+    their unique name, caption and level.
+    """
+    __slots__ = ()
+
+    def membersQuery(self, setexpr):
+        return "SELECT {} ON COLUMNS, %s DIMENSION PROPERTIES %s ON ROWS FROM %s" % (
+            setexpr, ", ".join(MEMBER_PROPERTIES), bracket(self.CUBE_NAME))
+
+    def membersResult(self, res):
+        """Turn the members on the rows of res into XMLAMember instances."""
+        rows = []
+        for tup in res.getAxisTuple("Axis1") or []:
+            m = aslist(tup)[0]
+            row = {"CATALOG_NAME": self.CATALOG_NAME,
+                   "CUBE_NAME": self.CUBE_NAME,
+                   "HIERARCHY_UNIQUE_NAME": m.get("_Hierarchy"),
+                   "LEVEL_UNIQUE_NAME": m.LName,
+                   "LEVEL_NUMBER": m.LNum,
+                   "MEMBER_UNIQUE_NAME": m.UName,
+                   "MEMBER_CAPTION": m.Caption}
+            for prop in MEMBER_PROPERTIES:
+                if m.get(prop) is not None:
+                    row[prop] = m[prop]
+            row.setdefault("PARENT_UNIQUE_NAME", "")
+            row.setdefault("PARENT_COUNT", "1" if row["PARENT_UNIQUE_NAME"] else "0")
+            rows.append(row)
+        return self.objectfactory("XMLAMember", "MEMBER_UNIQUE_NAME", "TREE_MEMBER", rows)
+
+    def queryMembers(self, setexpr):
+        """Return the members of the MDX set expression setexpr."""
+        res = self._conn.Execute(self.membersQuery(setexpr), Catalog=self.CATALOG_NAME)
+        return self.membersResult(res)
+
+    def childrenSet(self, names):
+        return "{%s}" % ", ".join("%s.Children" % n for n in names)
+
+    def childrenResult(self, names, members):
+        grouped = dict((n, []) for n in names)
+        for m in members:
+            if m.getParentName() in grouped:
+                grouped[m.getParentName()].append(m)
+        return grouped
+
+    def ancestorsSet(self, names):
+        return "{%s}" % ", ".join("Ascendants(%s)" % n for n in names)
+
+    def ancestorsResult(self, names, members):
+        byname = dict((m.getUniqueName(), m) for m in members)
+        grouped = {}
+        for n in names:
+            chain = grouped[n] = []
+            parent = byname[n].getParentName() if n in byname else None
+            while parent in byname:
+                chain.append(byname[parent])
+                parent = byname[parent].getParentName()
+        return grouped
+
+    def queryGroups(self, members, setexpr):
+        """Return the members of the sets setexpr makes of the names of
+        members, one query per hierarchy since a set can't mix them. If
+        the hierarchies were guessed wrong the names are queried one by one."""
+        found = []
+        for names in hierarchyGroups(members):
+            try:
+                found.extend(self.queryMembers(setexpr(names)))
+            except XMLAException:
+                if len(names) == 1:
+                    raise
+                for n in names:
+                    found.extend(self.queryMembers(setexpr([n])))
+        return found
+
+    def getChildrenMany(self, members):
+        """Return the children of all members in a dict mapping the unique
+        name of each member to the list of its children."""
+        names = uniqueNames(members)
+        if not names:
+            return {}
+        return self.childrenResult(names, self.queryGroups(members, self.childrenSet))
+
+    def getAncestorsMany(self, members):
+        """Return the ancestors of all members in a dict mapping the unique
+        name of each member to its ancestors, starting with the parent."""
+        names = uniqueNames(members)
+        if not names:
+            return {}
+        return self.ancestorsResult(names, self.queryGroups(members, self.ancestorsSet))
+
+
 @zope.interface.implementer(IXMLASource, ooi.IOLAPSource, ooi.IConnection)
 class XMLASource(XMLAConnection, XMLAClass):
 
@@ -150,6 +375,66 @@ class XMLASource(XMLAConnection, XMLAClass):
     def getOLAPSource(self):
         return self
 
+    def rowCount(self, rows, cube, where=None, **kwargs):
+        """Return the number of tuples in the MDX set rows on cube."""
+        stmt = "WITH MEMBER [Measures].[olapRowCount] AS Count(%s) " \
+               "SELECT {[Measures].[olapRowCount]} ON COLUMNS FROM %s" % (rows, bracket(cube))
+        if where is not None:
+            stmt += " WHERE %s" % where
+        value = self.Execute(stmt, **kwargs).getSlice(properties="Value")[0]
+        return int(float(value or 0))
+
+    def pageStatements(self, columns, rows, cube, where=None, page_size=10000,
+                       non_empty=False, **kwargs):
+        """Return the statements selecting the pages of page_size tuples
+        of rows, see iterPages."""
+        total = self.rowCount(rows, cube, where, **kwargs)
+        stmts = []
+        for start in range(0, max(total, 1), page_size):
+            stmt = "SELECT %s ON COLUMNS, %sSUBSET(%s, %d, %d) ON ROWS FROM %s" % (
+                columns, "NON EMPTY " if non_empty else "", rows, start, page_size, bracket(cube))
+            if where is not None:
+                stmt += " WHERE %s" % where
+            stmts.append(stmt)
+        return stmts
+
+    def iterPages(self, columns, rows, cube, where=None, page_size=10000,
+                  non_empty=False, pool=None, **kwargs):
+        """
+        Execute SELECT columns ON COLUMNS, rows ON ROWS FROM cube [WHERE where]
+        in pages of at most page_size rows, using SUBSET on the row set, and
+        yield the result of each page in order. The tuples of rows are
+        counted by a first statement. non_empty drops the empty rows of each
+        page, so pages may have less rows.
+
+        The pages run one after the other on this connection, or in parallel
+        on the connections of an ExecutorPool passed as pool, with at most
+        twice as many pages as the pool has workers held at a time.
+        kwargs are passed to Execute, e.g. Catalog.
+        """
+        stmts = self.pageStatements(columns, rows, cube, where, page_size, non_empty, **kwargs)
+        if pool is None:
+            for stmt in stmts:
+                yield self.Execute(stmt, **kwargs)
+            return
+
+        pending = deque()
+        for stmt in stmts:
+            pending.append(pool.submit(None, stmt, kwargs))
+            if len(pending) >= 2 * pool.max_workers:
+                yield pending.popleft().result().getResult()
+        while pending:
+            yield pending.popleft().result().getResult()
+
+    def executePaged(self, columns, rows, cube, where=None, page_size=10000,
+                     non_empty=False, pool=None, **kwargs):
+        """Execute the statement of iterPages in pages and return the pages
+        as one result, as if it had been executed at once."""
+        pages = list(self.iterPages(columns, rows, cube, where, page_size,
+                                    non_empty, pool, **kwargs))
+        columnar = kwargs.get("columnar")
+        return mergePages(pages, columnar=self.columnar if columnar is None else columnar)
+
     # IOLAPSource interface
     def getCatalogs(self):
         """Returns a list of catalogs in the Datasource."""
@@ -162,6 +447,7 @@ class XMLASource(XMLAConnection, XMLAClass):
 
 @zope.interface.implementer(ooi.ICatalog)
 class XMLACatalog(XMLAClass):
+    __slots__ = ()
 
     def getCubes(self):
         return self.getCube(None)
@@ -200,7 +486,8 @@ class XMLACatalog(XMLAClass):
 
 
 @zope.interface.implementer(ooi.ICube)
-class XMLACube(XMLAClass):
+class XMLACube(XMLAClass, XMLAMemberQueries):
+    __slots__ = ()
 
     def getHierarchies(self):
         return self.getHierarchy(None)
@@ -233,7 +520,8 @@ class XMLACube(XMLAClass):
 
 
 @zope.interface.implementer(ooi.IHierarchy)
-class XMLAHierarchy(XMLAClass):
+class XMLAHierarchy(XMLAClass, XMLAMemberQueries):
+    __slots__ = ("_index",)
 
     def getLevels(self):
         return self.getLevel(None)
@@ -249,9 +537,39 @@ class XMLAHierarchy(XMLAClass):
         return self.getSchemaElements("HIERARCHY_MEMBER", unique_name,
                                       aslist=unique_name == None)
 
+    def iterMembers(self):
+        """Yield the members of this hierarchy while they are read."""
+        return self.iterSchemaElements("HIERARCHY_MEMBER")
+
+    def getIndex(self, refresh=False):
+        """Return a HierarchyIndex of all members of this hierarchy, it is
+        loaded on first use and kept with the hierarchy."""
+        if refresh or getattr(self, "_index", None) is None:
+            self._index = HierarchyIndex(self.getMembers())
+        return self._index
+
+    def refreshIndex(self, member=None):
+        """Reload member and its descendants into the index, or all members
+        if member is None."""
+        if member is None or getattr(self, "_index", None) is None:
+            return self.getIndex(refresh=True)
+        self._index.replaceSubtree(member, self.getSubtree(member))
+        return self._index
+
+    def getSubtree(self, member):
+        """Return member and its descendants, an empty list if member
+        doesn't exist (anymore)."""
+        try:
+            return self.getSchemaElements("TREE_MEMBER", uniqueNames([member])[0],
+                                          aslist=True,
+                                          more_restrictions={"TREE_OP": TREE_OP.SELF | TREE_OP.DESCENDANTS})
+        except SchemaElementNotFound:
+            return []
+
 
 @zope.interface.implementer(ooi.ILevel)
-class XMLALevel(XMLAClass):
+class XMLALevel(XMLAClass, XMLAMemberQueries):
+    __slots__ = ()
 
     def getMembers(self):
         return self.getMember(None)
@@ -260,6 +578,10 @@ class XMLALevel(XMLAClass):
         return self.getSchemaElements("MEMBER", unique_name,
                                       aslist=unique_name == None)
 
+    def iterMembers(self):
+        """Yield the members of this level while they are read."""
+        return self.iterSchemaElements("MEMBER")
+
     def getProperties(self):
         return self.getProperty(None)
 
@@ -269,7 +591,8 @@ class XMLALevel(XMLAClass):
 
 
 @zope.interface.implementer(ooi.IMember)
-class XMLAMember(XMLAClass):
+class XMLAMember(XMLAClass, XMLAMemberQueries):
+    __slots__ = ()
 
     def getParent(self):
         """Return this members parent member or None if this is the root
@@ -319,21 +642,45 @@ class XMLAMember(XMLAClass):
                                       aslist=True,
                                       more_restrictions={"TREE_OP": TREE_OP.ANCESTORS})
 
+    def descendantsSet(self, depth):
+        return "Descendants(%s, %d, SELF_AND_BEFORE)" % (self.getUniqueName(), depth)
+
+    def descendantsResult(self, members):
+        return [m for m in members if m.getUniqueName() != self.getUniqueName()]
+
+    def getDescendants(self, depth=None):
+        """Return the members below this one down to depth levels, or the
+        whole subtree if depth is None, in hierarchy order (self not included).
+        Use groupByParent to get them grouped per parent."""
+        if depth is None:
+            try:
+                return self.getSchemaElements("TREE_MEMBER",
+                                              self.getUniqueName(),
+                                              aslist=True,
+                                              more_restrictions={"TREE_OP": TREE_OP.DESCENDANTS})
+            except SchemaElementNotFound:
+                return []
+        return self.descendantsResult(self.queryMembers(self.descendantsSet(depth)))
+
 
 @zope.interface.implementer(ooi.IMeasure)
-class XMLAMeasure(XMLAClass): pass
+class XMLAMeasure(XMLAClass):
+    __slots__ = ()
 
 
 @zope.interface.implementer(ooi.IProperty)
-class XMLAProperty(XMLAClass): pass
+class XMLAProperty(XMLAClass):
+    __slots__ = ()
 
 
 @zope.interface.implementer(ooi.ISet)
-class XMLASet(XMLAClass): pass
+class XMLASet(XMLAClass):
+    __slots__ = ()
 
 
 @zope.interface.implementer(ooi.IDimension)
 class XMLADimension(XMLAClass):
+    __slots__ = ()
 
     def getHierarchies(self):
         return self.getHierarchy(None)
@@ -351,3 +698,8 @@ class XMLADimension(XMLAClass):
 
 # root.x().getCatalog("FoodMart").getCube("Sales").getHierarchy("[Customers]").getLevel("[Customers].[Country]").getMembers()
 # root.x().getCatalog("FoodMart").getCube("HR").getHierarchy("[Employees]").getLevel("[Employees].[Employee Id]").getProperty("Marital Status")._properties
+
+
+XMLAClass.elementclasses = dict((clazz.__name__, clazz) for clazz in
+                                (XMLACatalog, XMLACube, XMLAHierarchy, XMLALevel, XMLAMember,
+                                 XMLAMeasure, XMLAProperty, XMLASet, XMLADimension))
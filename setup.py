@@ -15,6 +15,9 @@ setup(name='olap3',
       package_dir={'olap': 'olap'},
       package_data={'olap.xmla': ['*.wsdl']},
       install_requires=required,
+      extras_require={"columnar": ["numpy"],
+                      "arrow": ["pyarrow"],
+                      "async": ["httpx"]},
       url="https://github.com/robert-werner/olap3",
       license='Apache Software License 2.0',
       classifiers=[
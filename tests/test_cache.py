@@ -0,0 +1,105 @@
+'''
+The Execute result cache and the keys results are cached under.
+'''
+import threading
+import time
+import unittest
+
+from olap.xmla.cache import ResultCache, isQuery, normalizeMDX
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = ResultCache()
+        self.assertEqual(cache.fetch("a", lambda: [1, 2]), [1, 2])
+        self.assertEqual(cache.fetch("a", lambda: self.fail("computed again")), [1, 2])
+        cache.fetch("b", lambda: 3)
+        stats = cache.getStats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 2, 2))
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.05)
+        cache.fetch("a", lambda: 1)
+        time.sleep(0.1)
+        self.assertEqual(cache.fetch("a", lambda: 2), 2)
+        self.assertEqual(cache.getStats()["misses"], 2)
+
+    def test_evicts_least_recently_used(self):
+        value = "x" * 1000
+        cache = ResultCache(maxbytes=2500)
+        cache.fetch("a", lambda: value)
+        cache.fetch("b", lambda: value)
+        cache.fetch("a", lambda: value)
+        cache.fetch("c", lambda: value)
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertLessEqual(cache.bytes, 2500)
+        self.assertEqual(cache.getStats()["evictions"], 1)
+
+    def test_too_large_is_not_kept(self):
+        cache = ResultCache(maxbytes=100)
+        cache.fetch("a", lambda: "x" * 1000)
+        self.assertEqual(cache.getStats()["size"], 0)
+
+    def test_concurrent_fetches_share_compute(self):
+        cache = ResultCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.fetch("a", compute)))
+                   for i in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        while cache.getStats()["shared"] < 3:
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 4)
+        self.assertEqual(cache.getStats()["shared"], 3)
+
+    def test_error_is_shared_not_cached(self):
+        cache = ResultCache()
+
+        def fail():
+            raise ValueError("no")
+
+        self.assertRaises(ValueError, cache.fetch, "a", fail)
+        self.assertEqual(cache.fetch("a", lambda: 1), 1)
+
+
+class TestKeys(unittest.TestCase):
+
+    def test_normalize(self):
+        a = "SELECT {[Measures].[Unit Sales]} ON 0\nFROM [Sales]"
+        b = "-- units\nSELECT  {[Measures].[Unit Sales]} /* all */ ON 0\n\tFROM [Sales] // done"
+        self.assertEqual(normalizeMDX(a), normalizeMDX(b))
+
+    def test_names_keep_their_case(self):
+        self.assertNotEqual(normalizeMDX('SELECT StrToMember("[Store].[usa]") ON 0 FROM Sales'),
+                            normalizeMDX('SELECT StrToMember("[Store].[USA]") ON 0 FROM Sales'))
+        self.assertNotEqual(normalizeMDX("SELECT Measures.units ON 0 FROM Sales"),
+                            normalizeMDX("SELECT Measures.UNITS ON 0 FROM Sales"))
+
+    def test_only_queries(self):
+        self.assertTrue(isQuery("select 1 on 0 from [Sales]"))
+        self.assertTrue(isQuery("/* x */ WITH MEMBER [Measures].[a] AS 1 SELECT [Measures].[a] ON 0 FROM [Sales]"))
+        for command in ("CLEAR CACHE", "REFRESH CUBE [Sales]", "CREATE MEMBER [Sales].[Measures].[a] AS 1",
+                        "ALTER CUBE [Sales] UPDATE DIMENSION [Store]", "UPDATE CUBE [Sales] SET ([Store].[USA]) = 1",
+                        "-- SELECT\nDROP MEMBER [Sales].[Measures].[a]"):
+            self.assertFalse(isQuery(command), command)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+'''
+Envelopes filled into templates have to match the ones zeep renders.
+'''
+import unittest
+
+from lxml import etree
+
+from olap.xmla.envelope import EnvelopeTemplate
+
+from test_execute import EMPTY, connect
+
+
+def render(values):
+    root = etree.Element("Execute")
+    command = etree.SubElement(root, "Statement")
+    command.text = values[0]
+    etree.SubElement(root, "Property", name=values[1])
+    return etree.tostring(root, encoding="utf-8")
+
+
+class TestEnvelopeTemplate(unittest.TestCase):
+
+    values = ['SELECT {[Store].[A & B <1>]} ON 0 FROM [Sales] WHERE "x" = \'y\'\r',
+              'say "<hi>" & \'bye\'\n\tnow']
+
+    def test_escaping(self):
+        template = EnvelopeTemplate.compile(render, 2)
+        envelope = template.render(self.values)
+        self.assertEqual(envelope, render(self.values))
+        root = etree.fromstring(envelope)
+        self.assertEqual(root.find("Statement").text, self.values[0])
+        self.assertEqual(root.find("Property").get("name"), self.values[1])
+
+    def test_markers_not_found(self):
+        self.assertIsNone(EnvelopeTemplate.compile(lambda values: render(["", ""]), 2))
+
+    def test_templates_imply_raw_transport(self):
+        conn = connect(EMPTY, soap_templates=True)
+        self.assertTrue(conn.raw_transport)
+        conn.Execute("SELECT {} ON 0 FROM [Sales]", Catalog="FoodMart")
+        self.assertTrue(conn.templates)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+'''
+Execute against canned XMLA responses, served by a requests adapter
+instead of a server.
+'''
+import io
+import unittest
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+import olap.xmla.xmla as xmla
+
+ENVELOPE = ('<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<SOAP-ENV:Body>%s</SOAP-ENV:Body></SOAP-ENV:Envelope>')
+
+EMPTY = ('<cxmla:ExecuteResponse xmlns:cxmla="urn:schemas-microsoft-com:xml-analysis">'
+         '<cxmla:return><root xmlns="urn:schemas-microsoft-com:xml-analysis:empty"/></cxmla:return>'
+         '</cxmla:ExecuteResponse>')
+
+
+class CannedAdapter(BaseAdapter):
+    """Answers every request with payload in a soap envelope."""
+
+    def __init__(self, payload):
+        super(CannedAdapter, self).__init__()
+        self.payload = payload
+
+    def send(self, request, **kwargs):
+        res = Response()
+        res.status_code = 200
+        res.url = request.url
+        res.request = request
+        res.headers["Content-Type"] = "text/xml"
+        res._content = (ENVELOPE % self.payload).encode("utf-8")
+        res.raw = io.BytesIO(res._content)
+        return res
+
+    def close(self):
+        pass
+
+
+def connect(payload, **kwargs):
+    session = requests.Session()
+    session.mount("http://", CannedAdapter(payload))
+    return xmla.XMLAProvider().connect(location="http://xmla.test/xmla", session=session, **kwargs)
+
+
+class TestCommandWithoutResult(unittest.TestCase):
+    command = "CREATE MEMBER [Sales].[Measures].[Profit] AS [Measures].[Store Sales] - [Measures].[Store Cost]"
+
+    def test_execute(self):
+        for raw in (False, True):
+            for streaming in (False, True):
+                conn = connect(EMPTY, raw_transport=raw, soap_templates=raw)
+                self.assertIsNone(conn.Execute(self.command, Catalog="FoodMart", streaming=streaming))
+
+
+if __name__ == "__main__":
+    unittest.main()
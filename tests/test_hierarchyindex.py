@@ -0,0 +1,93 @@
+'''
+Navigation of the local member index of a hierarchy.
+'''
+import unittest
+
+from olap.xmla.hierarchyindex import HierarchyIndex
+
+
+class Member(object):
+    """Stands in for a XMLAMember."""
+
+    def __init__(self, name, parent, level):
+        self.name = name
+        self.parent = parent
+        self.LEVEL_NUMBER = str(level)
+        self.LEVEL_UNIQUE_NAME = "[Store].[L%d]" % level
+
+    def getUniqueName(self):
+        return self.name
+
+    def getParentName(self):
+        return self.parent
+
+
+def members(*rows):
+    return [Member(name, parent, level) for (name, parent, level) in rows]
+
+
+STORES = members(("[All]", None, 0),
+                 ("[USA]", "[All]", 1),
+                 ("[CA]", "[USA]", 2),
+                 ("[OR]", "[USA]", 2),
+                 ("[WA]", "[USA]", 2),
+                 ("[Mexico]", "[All]", 1),
+                 ("[Jalisco]", "[Mexico]", 2))
+
+
+def names(ms):
+    return [m.getUniqueName() for m in ms]
+
+
+class TestHierarchyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = HierarchyIndex(STORES)
+
+    def test_children(self):
+        self.assertEqual(names(self.index.getChildren("[USA]")), ["[CA]", "[OR]", "[WA]"])
+        self.assertEqual(names(self.index.getChildren("[CA]")), [])
+        self.assertTrue(self.index.hasChildren("[Mexico]"))
+        self.assertFalse(self.index.hasChildren("[Jalisco]"))
+
+    def test_siblings(self):
+        self.assertEqual(names(self.index.getSiblings("[OR]")), ["[CA]", "[WA]"])
+        self.assertEqual(names(self.index.getSiblings("[Mexico]")), ["[USA]"])
+        self.assertEqual(names(self.index.getSiblings("[All]")), [])
+        self.assertFalse(self.index.hasSiblings("[Jalisco]"))
+
+    def test_ancestors(self):
+        self.assertEqual(names(self.index.getAncestors("[WA]")), ["[USA]", "[All]"])
+        self.assertEqual(names(self.index.getAncestors("[All]")), [])
+        self.assertEqual(self.index.getParent("[Jalisco]").getUniqueName(), "[Mexico]")
+
+    def test_descendants_and_levels(self):
+        self.assertEqual(names(self.index.getDescendants("[All]", depth=1)), ["[USA]", "[Mexico]"])
+        self.assertEqual(names(self.index.getDescendants("[USA]")), ["[CA]", "[OR]", "[WA]"])
+        self.assertEqual(names(self.index.getLevelMembers("[Store].[L2]")),
+                         ["[CA]", "[OR]", "[WA]", "[Jalisco]"])
+
+    def assertSameIndex(self, index, expected):
+        for name in ("members", "parents", "depths", "ends", "childoffsets", "children",
+                     "levels", "leveloffsets", "levelmembers"):
+            self.assertEqual(list(getattr(index, name)), list(getattr(expected, name)), name)
+        self.assertEqual(index.positions, expected.positions)
+
+    def test_replace_subtree(self):
+        usa = members(("[USA]", "[All]", 1), ("[CA]", "[USA]", 2), ("[LA]", "[CA]", 3))
+        self.index.replaceSubtree("[USA]", usa)
+        self.assertSameIndex(self.index, HierarchyIndex(STORES[:1] + usa + STORES[5:]))
+        self.assertEqual(names(self.index.getAncestors("[LA]")), ["[CA]", "[USA]", "[All]"])
+
+    def test_remove_and_add_subtree(self):
+        self.index.replaceSubtree("[USA]", [])
+        self.assertSameIndex(self.index, HierarchyIndex(STORES[:1] + STORES[5:]))
+        self.assertNotIn("[CA]", self.index)
+        canada = members(("[Canada]", "[All]", 1), ("[BC]", "[Canada]", 2))
+        self.index.replaceSubtree("[Canada]", canada)
+        self.assertSameIndex(self.index, HierarchyIndex(STORES[:1] + STORES[5:] + canada))
+        self.assertEqual(names(self.index.getChildren("[All]")), ["[Mexico]", "[Canada]"])
+
+
+if __name__ == "__main__":
+    unittest.main()
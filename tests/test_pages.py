@@ -0,0 +1,59 @@
+'''
+Merging the pages of a result, each holding the next tuples of an axis.
+'''
+import unittest
+
+from olap.xmla.formatreader import NUMPY, TupleFormatReader, mergePages
+from olap.xmla.utils import Data
+
+
+COLUMNS = ["[M].[a]", "[M].[b]", "[M].[c]"]
+
+
+def axis(name, unames):
+    return Data(_name=name, Tuples=Data(Tuple=[Data(Member=Data(UName=n)) for n in unames]))
+
+
+def grid(columns, rows, columnar=False):
+    """Return the result of COLUMNS[columns] x rows, cells left out where
+    the row and column numbers add up to a multiple of 3."""
+    cells = []
+    for (i, r) in enumerate(rows):
+        for (j, c) in enumerate(columns):
+            if (r + c) % 3:
+                cells.append(Data(_CellOrdinal=str(i * len(columns) + j), Value=r * 10 + c))
+    root = Data(Axes=Data(Axis=[axis("Axis0", [COLUMNS[c] for c in columns]),
+                                axis("Axis1", ["[R].[r%d]" % r for r in rows]),
+                                axis("SlicerAxis", ["[S].[all]"])]),
+                CellData=Data(Cell=cells))
+    return TupleFormatReader(root, columnar=columnar)
+
+
+class TestMergePages(unittest.TestCase):
+
+    def test_rows(self):
+        full = grid(range(3), range(7))
+        merged = mergePages([grid(range(3), range(0, 3)), grid(range(3), range(3, 6)),
+                             grid(range(3), range(6, 7))])
+        self.assertEqual([t.UName for t in merged.getAxisTuple("Axis1")],
+                         ["[R].[r%d]" % r for r in range(7)])
+        self.assertEqual(merged.getSlice(properties="Value"), full.getSlice(properties="Value"))
+        self.assertEqual(merged.getAxisTuple("SlicerAxis")[0].UName, "[S].[all]")
+
+    def test_columns(self):
+        rows = range(4)
+        full = grid(range(3), rows)
+        merged = mergePages([grid(range(2), rows), grid(range(2, 3), rows)], axis="Axis0")
+        self.assertEqual(len(merged.getAxisTuple("Axis0")), 3)
+        self.assertEqual(merged.getSlice(properties="Value"), full.getSlice(properties="Value"))
+
+    @unittest.skipUnless(NUMPY, "needs numpy")
+    def test_columnar(self):
+        full = grid(range(3), range(5))
+        merged = mergePages([grid(range(3), range(0, 2), columnar=True),
+                             grid(range(3), range(2, 5), columnar=True)])
+        self.assertEqual(merged.getSlice(properties="Value"), full.getSlice(properties="Value"))
+
+
+if __name__ == "__main__":
+    unittest.main()
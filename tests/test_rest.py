@@ -0,0 +1,67 @@
+'''
+Reading back the results of queries posted to the REST service.
+'''
+import unittest
+
+from olap.rest.pyramid import OLAPREST, _400, _404
+from olap.rest.store import MemoryQueryStore
+
+from test_store import result
+
+
+class Request(object):
+
+    def __init__(self, session, GET=None, **matchdict):
+        self.registry = None
+        self.session = session
+        self.matchdict = matchdict
+        self.GET = GET or {}
+
+
+class REST(OLAPREST):
+    fixedvalues = {}
+    querystore = MemoryQueryStore()
+
+
+class TestQuerySlicing(unittest.TestCase):
+
+    def setUp(self):
+        self.res = result(rows=6)
+        self.session = {"queries": ["q1"]}
+        REST.querystore.put("q1", self.res, mdx="SELECT ...", properties="Value")
+
+    def get(self, **GET):
+        return REST(Request(self.session, GET, QUERY_ID="q1")).query_get()
+
+    def test_whole(self):
+        got = self.get()
+        self.assertEqual(got["cells"], self.res.getSlice(properties="Value"))
+        self.assertEqual(got["axes"][1][0][0]["UName"], "[Store].[s0]")
+
+    def test_slices(self):
+        got = self.get(Axis0="1:3", Axis1="2,5")
+        self.assertEqual(got["cells"], self.res.getSlice(Axis0=[1, 2], Axis1=[2, 5], properties="Value"))
+        self.assertEqual([len(tuples) for tuples in got["axes"]], [2, 2, 1])
+        self.assertEqual(got["counts"], {"Axis0": 3, "Axis1": 6})
+        self.assertEqual(self.get(Axis0=[0, 2], Axis1=4)["cells"],
+                         self.res.getSlice(Axis0=[0, 2], Axis1=[4], properties="Value"))
+
+    def test_pages(self):
+        got = self.get(page_size="4", page="1", properties="Value,FmtValue")
+        self.assertEqual((got["page"], got["pages"], got["page_axis"]), (1, 2, "Axis1"))
+        self.assertEqual(got["cells"], self.res.getSlice(Axis1=[4, 5], properties=["Value", "FmtValue"]))
+
+    def test_bad_selection(self):
+        for bad in ["x", "9", "1:y", 7, -1, True, None, 1.5, {"start": 1}, [0, "1"], [True], [0, None],
+                    [[0]]]:
+            with self.assertRaises(_400, msg=repr(bad)):
+                self.get(Axis1=bad)
+        self.assertRaises(_400, self.get, page_size="0")
+        self.assertRaises(_400, self.get, page_size=None)
+
+    def test_unknown_query(self):
+        self.assertRaises(_404, REST(Request({}, QUERY_ID="q1")).query_get)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+'''
+Opening and closing the sessions of a SessionPool.
+'''
+import unittest
+
+from olap.xmla.interfaces import XMLAException
+from olap.xmla.sessionpool import SessionPool
+
+
+class Session(object):
+
+    def __init__(self, sessionId):
+        self.sessionId = sessionId
+
+
+class Connection(object):
+    """Opens sessions until failing on the failing-th one."""
+
+    def __init__(self, failing=None):
+        self.failing = failing
+        self.opened = 0
+        self.closed = []
+
+    def openSession(self):
+        self.opened += 1
+        if self.opened == self.failing:
+            raise XMLAException("no more sessions", None)
+        return Session(self.opened)
+
+    def closeSession(self, sessionId):
+        self.closed.append(sessionId)
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def test_close(self):
+        conn = Connection()
+        pool = SessionPool(conn, size=3)
+        self.assertEqual(pool.getStats()["idle"], 3)
+        pool.close()
+        self.assertEqual(sorted(conn.closed), [1, 2, 3])
+
+    def test_failing_open_closes_the_opened(self):
+        conn = Connection(failing=3)
+        self.assertRaises(XMLAException, SessionPool, conn, size=4)
+        self.assertEqual(sorted(conn.closed), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
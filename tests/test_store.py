@@ -0,0 +1,89 @@
+'''
+Encoding query results for the REST service's result stores.
+'''
+import shutil
+import tempfile
+import unittest
+
+from olap.rest.store import DiskQueryStore, MemoryQueryStore, StoredResult, encodeResult
+from olap.xmla.formatreader import TupleFormatReader
+from olap.xmla.utils import Data
+
+
+def member(hierarchy, name):
+    return Data(_Hierarchy=hierarchy, UName="%s.[%s]" % (hierarchy, name), Caption=name, LNum="1")
+
+
+def result(rows=4):
+    columns = [Data(Member=member("[Measures]", name)) for name in ("Sales", "Count", "Label")]
+    tuples = [Data(Member=[member("[Store]", "s%d" % r), member("[Time]", "1997")]) for r in range(rows)]
+    cells = []
+    for r in range(rows):
+        if r != 2:
+            cells.append(Data(_CellOrdinal=str(3 * r), Value=r * 1.5, FmtValue="%.1f" % (r * 1.5)))
+        cells.append(Data(_CellOrdinal=str(3 * r + 1), Value=r * 10 ** 12))
+        cells.append(Data(_CellOrdinal=str(3 * r + 2), Value="label %d" % (r % 2)))
+    root = Data(Axes=Data(Axis=[Data(_name="Axis0", Tuples=Data(Tuple=columns)),
+                                Data(_name="Axis1", Tuples=Data(Tuple=tuples)),
+                                Data(_name="SlicerAxis", Tuples=Data(Tuple=Data(Member=member("[Year]", "all"))))]),
+                CellData=Data(Cell=cells))
+    return TupleFormatReader(root)
+
+
+class TestStoredResult(unittest.TestCase):
+
+    def test_round_trip(self):
+        res = result()
+        stored = StoredResult(encodeResult(res, id="q1", mdx="SELECT ..."))
+        self.assertEqual(stored.meta, {"id": "q1", "mdx": "SELECT ..."})
+        self.assertEqual(stored.getSlice(), res.getSlice())
+        self.assertEqual(stored.getSlice(properties=["Value", "FmtValue"]),
+                         res.getSlice(properties=["Value", "FmtValue"]))
+        self.assertEqual(stored.getSlice(Axis1=[1, 2], properties="Value"),
+                         res.getSlice(Axis1=[1, 2], properties="Value"))
+
+    def test_axis_members(self):
+        stored = StoredResult(encodeResult(result()))
+        self.assertEqual(stored.getAxisTuple(0)[1].UName, "[Measures].[Count]")
+        (store, time) = stored.getAxisTuple("Axis1")[3]
+        self.assertEqual((store.UName, time.Caption), ("[Store].[s3]", "1997"))
+        self.assertEqual(stored.getAxisTuple("SlicerAxis")[0]._Hierarchy, "[Year]")
+        self.assertEqual(stored.getTupleCount(stored.getAxes()[1]), 4)
+
+
+class TestQueryStores(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory(self):
+        store = MemoryQueryStore()
+        store.put("q1", result(), mdx="SELECT ...")
+        self.assertEqual(store.get("q1").getSlice(), result().getSlice())
+        self.assertEqual(store.getInfo("q1")["counts"], {"Axis0": 3, "Axis1": 4, "SlicerAxis": 1})
+        self.assertIsNone(store.get("q2"))
+
+    def test_disk_shared(self):
+        store = DiskQueryStore(self.directory)
+        store.put("q1", result())
+        other = DiskQueryStore(self.directory)
+        self.assertIn("q1", other)
+        self.assertEqual(other.get("q1").getAxisTuple(1)[0][0].UName, "[Store].[s0]")
+
+    def test_disk_evicts(self):
+        size = len(encodeResult(result(), id="q0"))
+        store = DiskQueryStore(self.directory, maxbytes=int(size * 2.5))
+        for i in range(4):
+            store.put("q%d" % i, result())
+            store.get("q0")
+        self.assertEqual(len(store), 2)
+        self.assertIn("q0", store)
+        self.assertIn("q3", store)
+        self.assertEqual(store.getStats()["evictions"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()